@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from argparse import ArgumentParser
+from typing import Any, Callable
+
+this_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(this_dir.parent))
+
+from xed_db import input_xed_db, fix_xed_db, convert_xed_db, output_json, output_csv, output_sqlite
+from xed_opcode_map import collect_all_maps, html_all_maps, input_sqlite_db
+from gen_sdm_urls import get_sdm_name
+
+default_fake_pysrc = str(this_dir / 'fake_xed')
+default_sizes = [1000, 10000, 100000]
+
+BenchResult = dict[str, Any]
+
+def run_stage(stage: str, num_items: int, func: Callable[[Any], Any], setup: Callable[[], Any],
+              trace_memory: bool) -> tuple[Any, BenchResult]:
+    arg = setup()
+    start_time = time.perf_counter()
+    val = func(arg)
+    elapsed = time.perf_counter() - start_time
+    peak_bytes = None
+    if trace_memory:
+        arg = setup()
+        tracemalloc.start()
+        func(arg)
+        (_, peak_bytes) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    result = {
+        'stage': stage,
+        'items': num_items,
+        'seconds': elapsed,
+        'items_per_second': num_items / elapsed if elapsed > 0 else None,
+        'peak_bytes': peak_bytes,
+    }
+    print(f'[INFO] {stage}: {num_items} items in {elapsed:.3f}s')
+    return (val, result)
+
+def no_setup() -> None:
+    return None
+
+def make_sdm_dict(iclasses: list[str]) -> dict[str, str]:
+    names = sorted(set([ iclass.lower().split('_')[0] for iclass in iclasses ]))
+    return { name: name for name in names[::2] }
+
+def bench_size(num_forms: int, seed: int, pysrc: str, work_dir: Path, trace_memory: bool) -> list[BenchResult]:
+    dgen = work_dir / f'dgen_{num_forms}'
+    dgen.mkdir(parents=True, exist_ok=True)
+    with open(dgen / 'synthetic.json', 'w') as spec_fp:
+        json.dump({ 'num_forms': num_forms, 'seed': seed }, spec_fp)
+    results = []
+    def stage(name: str, num_items: int, func: Callable[[Any], Any], setup: Callable[[], Any] = no_setup) -> Any:
+        (val, result) = run_stage(name, num_items, func, setup, trace_memory)
+        results.append(dict(result, forms=num_forms))
+        return val
+    def convert(fixed_db: tuple[Any, list[str]]) -> tuple[list[Any], list[str]]:
+        (xed_db, inst_attrs) = fixed_db
+        return (list(convert_xed_db(xed_db, inst_attrs)), inst_attrs)
+    stage('fix_xed_db', num_forms, fix_xed_db, lambda: input_xed_db(str(dgen), pysrc))
+    (rows, inst_attrs) = stage('convert_xed_db', num_forms, convert, lambda: fix_xed_db(input_xed_db(str(dgen), pysrc)))
+    json_file = str(work_dir / f'bench_{num_forms}.json')
+    csv_file = str(work_dir / f'bench_{num_forms}.csv')
+    sqlite_file = str(work_dir / f'bench_{num_forms}.db')
+    stage('output_json', len(rows), lambda _: output_json(rows, inst_attrs, json_file))
+    stage('output_csv', len(rows), lambda _: output_csv(rows, inst_attrs, csv_file))
+    stage('output_sqlite', len(rows), lambda _: output_sqlite(rows, inst_attrs, sqlite_file))
+    stage('collect_all_maps', len(rows), lambda _: collect_all_maps(input_sqlite_db(sqlite_file)))
+    iclasses = [ row[inst_attrs.index('iclass')] for row in rows ]
+    sdm_dict = make_sdm_dict(iclasses)
+    sdm_urls = { iclass: f'https://example.com/x86/{iclass.lower()}' for iclass in set(iclasses) }
+    stage('html_all_maps', len(rows), lambda all_maps: len(html_all_maps(sdm_urls, all_maps)),
+          lambda: collect_all_maps(input_sqlite_db(sqlite_file)))
+    stage('get_sdm_name', len(iclasses), lambda _: [ get_sdm_name(iclass, sdm_dict) for iclass in iclasses ])
+    return results
+
+def compare_results(results: list[BenchResult], baseline_file: str) -> None:
+    with open(baseline_file) as baseline_fp:
+        baseline = json.load(baseline_fp)
+    base_seconds = { (result['forms'], result['stage']): result['seconds'] for result in baseline['results'] }
+    print(f'[INFO] compared with {baseline_file} (ratio > 1 is slower):')
+    for result in results:
+        base = base_seconds.get((result['forms'], result['stage']), None)
+        if base:
+            print(f'{result["forms"]:>9} {result["stage"]:<18} {result["seconds"] / base:6.2f}')
+
+def main() -> None:
+    parser = ArgumentParser(description='Benchmark the export and rendering pipeline on synthetic instruction tables')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes,
+                        help=f'numbers of synthetic instruction forms (default: {" ".join(map(str, default_sizes))})')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the synthetic tables (default: 1)')
+    parser.add_argument('--pysrc', default=default_fake_pysrc,
+                        help=f'directory of the stub gen_setup module (default: {default_fake_pysrc})')
+    parser.add_argument('--work-dir', type=str, help='directory for the outputs of the stages (default: a temporary directory)')
+    parser.add_argument('--no-memory', action='store_true', help='do not rerun each stage under tracemalloc to record its peak memory')
+    parser.add_argument('--baseline', type=str, help='results JSON file of an earlier run to compare against')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='output results JSON file (default: bench_results.json)')
+    args = parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(args.work_dir or tmp_dir)
+        for num_forms in args.sizes:
+            results += bench_size(num_forms, args.seed, args.pysrc, work_dir, not args.no_memory)
+    bench = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'trace_memory': not args.no_memory,
+        'results': results,
+    }
+    with open(args.output, 'w') as output_fp:
+        json.dump(bench, output_fp, indent=4)
+    if args.baseline:
+        compare_results(results, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import json
+import random
+from pathlib import Path
+from argparse import Namespace
+from read_xed_db import Restriction
+
+base_iclasses = [
+    'ADD', 'ADC', 'MOV', 'LEA', 'PUSH', 'XCHG', 'NOP', 'PAUSE', 'BSWAP', 'INT', 'UD2', 'JNZ', 'SETB', 'CMOVZ',
+    'REP_MOVSB', 'XADD_LOCK', 'FXSAVE64', 'PMOVSXBW', 'VPADDD', 'VADDPS', 'VPSHLDW', 'VFMADD132PS',
+]
+
+legacy_tokens = ['LOCK=1', 'LOCK=0', 'OSZ=1', 'OSZ=0', 'REP!=3', 'REP=0', 'REXW=1', 'NOREX2=1', 'REX2=1', 'P4=0', 'SRM=0']
+vex_evex_tokens = ['VL=0', 'VL=1', 'VL=2', 'ND=1', 'NF=0', 'REXW=0', 'REXW=1']
+modrm_tokens = ['MOD[mm]', 'MOD!=3', 'REG[rrr]', 'RM[nnn]', 'MODRM()']
+
+class CpuidRec:
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def __str__(self) -> str:
+        return self.field
+
+class CpuidGroup:
+
+    def __init__(self, recs: list[CpuidRec]):
+        self.recs = recs
+
+    def get_records(self) -> list[CpuidRec]:
+        return self.recs
+
+class InstRec:
+
+    def get_eosz_list(self) -> list[int]:
+        return [1, 2, 3] if len(self.iform) % 2 else []
+
+class XedDb:
+
+    def __init__(self, recs: list[InstRec]):
+        self.recs = recs
+
+def make_iclasses(rng: random.Random, num_forms: int) -> list[str]:
+    num_iclasses = max(len(base_iclasses), num_forms // 8)
+    return [ base_iclasses[i] if i < len(base_iclasses) else f'{rng.choice(base_iclasses)}_{i}'
+             for i in range(num_iclasses) ]
+
+def make_rec(rng: random.Random, idx: int, iclasses: list[str]) -> InstRec:
+    rec = InstRec()
+    space = rng.choice(['legacy', 'legacy', 'vex', 'evex'])
+    rec.iclass = rng.choice(iclasses)
+    rec.iform = f'{rec.iclass}_FORM{idx % 7}'
+    rec.space = space
+    rec.map = rng.randrange(0, 4) if space == 'legacy' else rng.choice([1, 2, 3, 5, 6])
+    rec.opcode_base10 = rng.randrange(0, 256)
+    rec.real_opcode = 'Y'
+    rec.partial_opcode = rng.random() < 0.05
+    if rec.partial_opcode:
+        rec.opcode_base10 &= 0xF8
+    rec.extension = rng.choice(['BASE', 'SSE', 'AVX', 'AVX512EVEX', '3DNOW', 'VIA_PADLOCK_AES'])
+    rec.isa_set = rng.choice(['I86', 'SSE2', 'AVX2', 'AVX512F_512', 'AVX512_VNNI_128', 'AVX512ER_512'])
+    rec.category = rng.choice(['BINARY', 'DATAXFER', 'COND_BR', 'AVX512'])
+    tokens = rng.sample(legacy_tokens if space == 'legacy' else vex_evex_tokens, 2)
+    has_modrm = rng.random() < 0.6
+    if has_modrm:
+        tokens += modrm_tokens
+    rec.pattern = f'  0x{rec.opcode_base10:02X}   ' + '  '.join(tokens) + ' MODE=2 '
+    rec.has_modrm = has_modrm
+    rec.mod_required = rng.choice([Restriction('00/01/10'), 3]) if has_modrm else Restriction('unspecified')
+    rec.reg_required = Restriction('unspecified')
+    rec.rm_required = Restriction('unspecified')
+    if rec.mod_required == 3:
+        rec.reg_required = rng.choice([Restriction('unspecified'), rng.randrange(8)])
+        rec.rm_required = rng.choice([Restriction('unspecified'), rng.randrange(8)])
+    rec.mode_restriction = rng.choice([Restriction('unspecified'), Restriction('not64'), 0, 1, 2])
+    rec.rexw_prefix = None if space == 'legacy' else rng.choice(['unspecified', '0', '1'])
+    rec.vl = 'n/a' if space == 'legacy' else rng.choice(['128', '256', '512', 'LIG'])
+    pp = rng.choice(['osz', 'f2', 'f3', 'np', ''] if space == 'legacy' else ['osz', 'f2', 'f3', 'np'])
+    rec.osz_required = pp == 'osz'
+    rec.f2_required = pp == 'f2'
+    rec.f3_required = pp == 'f3'
+    rec.no_prefixes_allowed = pp == 'np'
+    explicit = [ f'REG{i}=XED_REG_X:r' for i in range(rng.randrange(0, 4)) ]
+    implicit = ['REG9=XED_REG_FLAGS:w:SUPP'] if rng.random() < 0.5 else []
+    rec.operands = ' '.join(explicit + implicit) + '  '
+    rec.operand_list = explicit + implicit
+    rec.parsed_operands = None
+    rec.explicit_operands = [ f'r{i}' for i in range(len(explicit)) ] or ['none']
+    rec.implicit_operands = ['flags'] if implicit else ['none']
+    rec.attributes = rng.choice(['', 'AMDONLY', 'LOCKABLE  SCALABLE'])
+    rec.flags = 'MUST [ of-mod ]'
+    rec.comment = 'synthetic  form'
+    rec.cpl = rng.choice([0, 3])
+    rec.disasm_intel = None
+    rec.disasm = rng.choice([None, rec.iclass.lower()])
+    rec.cpuid_groups = [CpuidGroup([CpuidRec('INTEL64.1.0.EDX.CX8')])]
+    return rec
+
+def make_paths(args: Namespace) -> None:
+    with open(Path(args.prefix) / 'synthetic.json') as spec_fp:
+        spec = json.load(spec_fp)
+    args.num_forms = spec['num_forms']
+    args.seed = spec['seed']
+
+def read_db(args: Namespace) -> XedDb:
+    rng = random.Random(args.seed)
+    iclasses = make_iclasses(rng, args.num_forms)
+    return XedDb([ make_rec(rng, idx, iclasses) for idx in range(args.num_forms) ])
@@ -0,0 +1,4 @@
+class Restriction:
+
+    def __init__(self, name: str):
+        self.name = name
@@ -1,51 +1,145 @@
 #!/usr/bin/env python3
 
 import re
+import sys
 import json
+import time
+import hashlib
 import sqlite3
 from pathlib import Path
 from argparse import ArgumentParser
-from urllib.request import urlopen
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
 from datetime import date
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from xed_db import XedSnapshot
+from xed_profile import add_profile_argument, start_profile, finish_profile, profile_stage
 
 sdm_root_url = 'https://www.felixcloutier.com/x86/'
 
 re_href = re.compile(r"<a href='/x86/([^']+)'>")
 
-def collect_sdm_dict() -> Dict[str, str:]:
-    with urlopen(sdm_root_url) as sdm_root:
-        charsets = sdm_root.info().get_charsets()
-        sdm_top = sdm_root.read().decode(charsets[0])
-        matches = re_href.findall(sdm_top)
-        sdm_dict = dict()
-        for match in matches:
-            for name in match.split(':'):
-                sdm_dict[name] = match
-        return sdm_dict
+sdm_fetch_timeout = 30
+sdm_fetch_retries = 3
+
+def parse_sdm_index(sdm_top: str) -> Dict[str, str]:
+    matches = re_href.findall(sdm_top)
+    sdm_dict = dict()
+    for match in matches:
+        for name in match.split(':'):
+            sdm_dict[name] = match
+    return sdm_dict
+
+def read_sdm_index_file(sdm_index: Path) -> Dict[str, str]:
+    if sdm_index.is_dir():
+        sdm_index = sdm_index / 'index.html'
+    if sdm_index.suffix == '.json':
+        with open(sdm_index, 'r') as sdm_index_fp:
+            return json.load(sdm_index_fp)
+    return parse_sdm_index(sdm_index.read_text())
+
+def sdm_cache_paths(cache_dir: str, url: str) -> Tuple[Path, Path]:
+    url_key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    cache_path = Path(cache_dir)
+    return (cache_path / f'sdm_index_{url_key}.html', cache_path / f'sdm_index_{url_key}.json')
+
+def read_sdm_cache(page_path: Path, meta_path: Path) -> Tuple[Optional[str], Dict[str, Any]]:
+    if not (page_path.exists() and meta_path.exists()):
+        return (None, dict())
+    try:
+        with open(meta_path, 'r') as meta_fp:
+            meta = json.load(meta_fp)
+    except ValueError:
+        return (None, dict())
+    if not isinstance(meta, dict):
+        return (None, dict())
+    return (page_path.read_text(), meta)
+
+def write_sdm_cache(page_path: Path, meta_path: Path, sdm_top: Optional[str], meta: Dict[str, Any]) -> None:
+    page_path.parent.mkdir(parents=True, exist_ok=True)
+    if sdm_top is not None:
+        tmp_path = page_path.with_suffix('.tmp')
+        tmp_path.write_text(sdm_top)
+        tmp_path.replace(page_path)
+    tmp_path = meta_path.with_name(meta_path.name + '.tmp')
+    with open(tmp_path, 'w') as meta_fp:
+        json.dump(meta, meta_fp, indent=4)
+    tmp_path.replace(meta_path)
+
+def cache_age(meta: Dict[str, Any]) -> Optional[float]:
+    fetched = meta.get('fetched', None)
+    if not isinstance(fetched, (int, float)):
+        return None
+    return time.time() - fetched
+
+def fetch_sdm_index(url: str, cache_dir: Optional[str], timeout: float, retries: int, max_age: Optional[float]) -> str:
+    if retries < 0:
+        raise ValueError(f'negative number of retries: {retries}')
+    (page_path, meta_path) = sdm_cache_paths(cache_dir, url) if cache_dir else (None, None)
+    (cached_top, meta) = read_sdm_cache(page_path, meta_path) if cache_dir else (None, dict())
+    age = cache_age(meta)
+    if cached_top is not None and max_age is not None and age is not None and age < max_age:
+        print(f'[INFO] using cached SDM index: {page_path}', file=sys.stderr)
+        return cached_top
+    headers = dict()
+    if cached_top is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    for attempt in range(retries + 1):
+        try:
+            with urlopen(Request(url, headers=headers), timeout=timeout) as sdm_root:
+                charset = sdm_root.info().get_content_charset() or 'utf-8'
+                sdm_top = sdm_root.read().decode(charset)
+                if cache_dir:
+                    meta = {
+                        'url': url,
+                        'etag': sdm_root.headers.get('ETag'),
+                        'last_modified': sdm_root.headers.get('Last-Modified'),
+                        'fetched': time.time(),
+                    }
+                    write_sdm_cache(page_path, meta_path, sdm_top, meta)
+                return sdm_top
+        except HTTPError as err:
+            if err.code == 304 and cached_top is not None:
+                print(f'[INFO] SDM index not modified: {url}', file=sys.stderr)
+                meta['fetched'] = time.time()
+                write_sdm_cache(page_path, meta_path, None, meta)
+                return cached_top
+            if err.code < 500:
+                raise
+            error = err
+        except (URLError, TimeoutError) as err:
+            error = err
+        print(f'[INFO] fetching {url} failed ({error}); attempt {attempt + 1} of {retries + 1}', file=sys.stderr)
+        if attempt < retries:
+            time.sleep(2 ** attempt)
+    if cached_top is not None:
+        print(f'[INFO] using stale cached SDM index: {page_path}', file=sys.stderr)
+        return cached_top
+    raise error
+
+def collect_sdm_dict(sdm_index: str = sdm_root_url, cache_dir: Optional[str] = None, timeout: float = sdm_fetch_timeout,
+                     retries: int = sdm_fetch_retries, max_age: Optional[float] = None) -> Dict[str, str]:
+    if re.match(r'^https?://', sdm_index):
+        return parse_sdm_index(fetch_sdm_index(sdm_index, cache_dir, timeout, retries, max_age))
+    return read_sdm_index_file(Path(sdm_index))
 
 sql_query = '''
     SELECT DISTINCT iclass from Instructions;
 '''
 
 def collect_iclasses(db_file: str) -> List[str]:
+    if Path(db_file).suffix == '.snap':
+        with XedSnapshot(db_file) as snapshot:
+            return snapshot.distinct_values('iclass')
     with sqlite3.connect(db_file) as db:
         db.row_factory = sqlite3.Row
         insts = db.execute(sql_query)
         return [ inst['iclass'] for inst in insts ]
 
 cond_codes = '(o|no|b|nb|z|nz|be|nbe|s|ns|p|np|l|nl|le|nle)'
-re_jcc = re.compile(f'^j{cond_codes}$')
-re_setcc = re.compile(f'^set{cond_codes}$')
-re_cmovcc = re.compile(f'^cmov{cond_codes}$')
-re_fcmovcc = re.compile(r'^fcmov(b|nb|be|nbe|e|ne|u|nu)$')
-re_rep_string = re.compile(r'^(rep|repe|repne)_(in|out|mov|cmp|lod|sto|sca|)s.*$')
-
-re_prefix_1 = re.compile(r'^(?P<stem>vpshld|vpshldv|vpshrd|vpshrdv).$')
-re_prefix_any = re.compile(r'^(?P<stem>pmovsx|pmovzx|vbroadcast|vmaskmov|vpmaskmov|vpopcnt).*$')
-re_strip_suffix = re.compile(r'^(?P<stem>.+)_(lock|near|far|xmm|sse4)$')
-re_strip_64 = re.compile(r'^(?P<stem>fxsave|fxrstor|pcmpestri|pcmpestrm|pcmpistri|sysret|xrstor|xrstors|xsave|xsavec|xsaveopt|xsaves)64$')
-
 misc_dict = {
     'int': 'intn:into:int3:int1',
     'jcxz': 'jcc',
@@ -65,30 +159,36 @@ misc_dict = {
     'ud2': 'ud',
 }
 
+re_sdm_name = re.compile('|'.join([
+    f'(?P<jcc>j{cond_codes}$)',
+    f'(?P<setcc>set{cond_codes}$)',
+    f'(?P<cmovcc>cmov{cond_codes}$)',
+    r'(?P<fcmovcc>fcmov(b|nb|be|nbe|e|ne|u|nu)$)',
+    r'(?P<rep>(rep|repe|repne)_(in|out|mov|cmp|lod|sto|sca|)s.*$)',
+    r'(?P<prefix_1>vpshld|vpshldv|vpshrd|vpshrdv).$',
+    r'(?P<prefix_any>pmovsx|pmovzx|vbroadcast|vmaskmov|vpmaskmov|vpopcnt).*$',
+    r'(?:(?P<strip_64>fxsave|fxrstor|pcmpestri|pcmpestrm|pcmpistri|sysret|xrstor|xrstors|xsave|xsavec|xsaveopt|xsaves)64'
+    r'|(?P<stem>.+?))(?:_(?:lock|near|far|xmm|sse4))?$',
+]))
+
+sdm_rule_names = {
+    'jcc': 'jcc',
+    'setcc': 'setcc',
+    'cmovcc': 'cmovcc',
+    'fcmovcc': 'fcmovcc',
+    'rep': 'rep:repe:repz:repne:repnz',
+}
+
 def get_sdm_name(iclass: str, sdm_dict: Dict[str, str]) -> Optional[str]:
     iclass = iclass.lower()
-    if re_jcc.match(iclass):
-        return 'jcc'
-    if re_setcc.match(iclass):
-        return 'setcc'
-    if re_cmovcc.match(iclass):
-        return 'cmovcc'
-    if re_fcmovcc.match(iclass):
-        return 'fcmovcc'
-    if re_rep_string.match(iclass):
-        return 'rep:repe:repz:repne:repnz'
-    m = re_prefix_1.match(iclass)
-    if m:
-        return m.group('stem')
-    m = re_prefix_any.match(iclass)
-    if m:
-        return m.group('stem')
-    m = re_strip_suffix.match(iclass)
+    m = re_sdm_name.match(iclass)
     if m:
-        iclass = m.group('stem')
-    m = re_strip_64.match(iclass)
-    if m:
-        iclass = m.group('stem')
+        rule = m.lastgroup
+        if rule in sdm_rule_names:
+            return sdm_rule_names[rule]
+        if rule in ['prefix_1', 'prefix_any']:
+            return m.group(rule)
+        iclass = m.group(rule)
     name = misc_dict.get(iclass, None)
     if name:
         return name
@@ -99,10 +199,8 @@ def get_sdm_name(iclass: str, sdm_dict: Dict[str, str]) -> Optional[str]:
         return sdm_dict.get(iclass[1:], None)
     return None
 
-def collect_sdm_urls(iclasses: List[str], sdm_dict: Dict[str, str]) -> Dict[str, str]:
+def resolve_sdm_urls(iclasses: Iterable[str], sdm_dict: Dict[str, str]) -> Tuple[Dict[str, str], List[str]]:
     sdm_urls = dict()
-    cur_date = date.today()
-    sdm_urls['_COMMENT'] = f'generated on {cur_date}'
     missing = []
     for iclass in iclasses:
         name = get_sdm_name(iclass, sdm_dict)
@@ -110,6 +208,14 @@ def collect_sdm_urls(iclasses: List[str], sdm_dict: Dict[str, str]) -> Dict[str,
             sdm_urls[iclass] = sdm_root_url + name
         else:
             missing.append(iclass)
+    return (sdm_urls, missing)
+
+def collect_sdm_urls(iclasses: List[str], sdm_dict: Dict[str, str]) -> Dict[str, str]:
+    sdm_urls = dict()
+    cur_date = date.today()
+    sdm_urls['_COMMENT'] = f'generated on {cur_date}'
+    (iclass_urls, missing) = resolve_sdm_urls(iclasses, sdm_dict)
+    sdm_urls.update(iclass_urls)
     print('Missing iclasses:')
     for iclass in sorted(missing):
         print(iclass)
@@ -120,14 +226,37 @@ default_sdm_urls_json = str(this_dir / 'sdm_urls.json')
 
 def main() -> None:
     parser = ArgumentParser(description=f'Generate the mapping from iclasses to SDM instruction reference URLs in {sdm_root_url}')
-    parser.add_argument('sqlite', type=str, help='input SQLite database extracted from a XED build')
+    parser.add_argument('sqlite', type=str, help='input SQLite database (or .snap snapshot) extracted from a XED build')
     parser.add_argument('--sdm-urls-json', default=default_sdm_urls_json, help=f'output JSON file (default: {default_sdm_urls_json})')
+    parser.add_argument('--sdm-index', default=sdm_root_url,
+                        help=(f'URL of the SDM index page, or a saved copy of it (.html), a saved SDM index (.json), '
+                              f'or a directory containing index.html (default: {sdm_root_url})'))
+    parser.add_argument('--cache-dir', type=str,
+                        help='directory caching the SDM index page, which is then fetched by a conditional request')
+    parser.add_argument('--max-age', type=float,
+                        help='seconds for which the cached SDM index page is used without any request')
+    parser.add_argument('--timeout', type=float, default=sdm_fetch_timeout,
+                        help=f'timeout in seconds of fetching the SDM index page (default: {sdm_fetch_timeout})')
+    parser.add_argument('--retries', type=int, default=sdm_fetch_retries,
+                        help=f'number of retries of fetching the SDM index page (default: {sdm_fetch_retries})')
+    parser.add_argument('--save-sdm-index', type=str, help='output JSON file of the SDM index, usable later as --sdm-index')
+    add_profile_argument(parser)
     args = parser.parse_args()
-    sdm_dict = collect_sdm_dict()
-    iclasses = collect_iclasses(args.sqlite)
-    sdm_urls = collect_sdm_urls(iclasses, sdm_dict)
-    with open(args.sdm_urls_json, 'w') as sdm_urls_json_fp:
-        json.dump(sdm_urls, sdm_urls_json_fp, indent=4)
+    start_profile(args.profile)
+    with profile_stage('fetch sdm index'):
+        sdm_dict = collect_sdm_dict(args.sdm_index, args.cache_dir, args.timeout, args.retries, args.max_age)
+    if args.save_sdm_index:
+        with open(args.save_sdm_index, 'w') as sdm_index_fp:
+            json.dump(sdm_dict, sdm_index_fp, indent=4, sort_keys=True)
+    with profile_stage('sql query') as stage:
+        iclasses = collect_iclasses(args.sqlite)
+        stage['rows'] = len(iclasses)
+    with profile_stage('resolve sdm names', len(iclasses)):
+        sdm_urls = collect_sdm_urls(iclasses, sdm_dict)
+    with profile_stage('write json'):
+        with open(args.sdm_urls_json, 'w') as sdm_urls_json_fp:
+            json.dump(sdm_urls, sdm_urls_json_fp, indent=4)
+    finish_profile()
 
 if __name__ == '__main__':
     main()
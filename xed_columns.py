@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import sqlite3
+from pathlib import Path
+from contextlib import closing
+from argparse import ArgumentParser
+from typing import Any, Optional
+import numpy as np
+from xed_db import XedSnapshot
+from xed_opcode_map import max_num_maps
+
+categorical_attrs = ['iclass', 'extension', 'isa_set', 'space', 'category']
+numeric_attrs = ['map', 'opcode_int', 'partial_opcode']
+operand_attrs = ['operands', 'explicit_operands']
+
+class XedColumns:
+
+    def __init__(self, codes: dict[str, np.ndarray], categories: dict[str, list[Any]], numbers: dict[str, np.ndarray]):
+        self.codes = codes
+        self.categories = categories
+        self.numbers = numbers
+
+    def __len__(self) -> int:
+        return len(self.numbers['map'])
+
+    def category_codes(self, attr: str, vals: list[Any]) -> list[int]:
+        categories = self.categories[attr]
+        return [ categories.index(val) for val in vals if val in categories ]
+
+    def where(self, **conds: Any) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        for (attr, val) in conds.items():
+            vals = val if isinstance(val, list) else [val]
+            if attr in self.codes:
+                mask &= np.isin(self.codes[attr], self.category_codes(attr, vals))
+            else:
+                mask &= np.isin(self.numbers[attr], vals)
+        return mask
+
+    def count_by(self, attr: str, mask: Optional[np.ndarray] = None) -> dict[Any, int]:
+        if attr in self.codes:
+            codes = self.codes[attr] if mask is None else self.codes[attr][mask]
+            counts = np.bincount(codes, minlength=len(self.categories[attr]))
+            return { cat: int(count) for (cat, count) in zip(self.categories[attr], counts) if count }
+        numbers = self.numbers[attr] if mask is None else self.numbers[attr][mask]
+        (vals, counts) = np.unique(numbers, return_counts=True)
+        return { int(val): int(count) for (val, count) in zip(vals, counts) }
+
+    def opcode_occupancy(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        maps = self.numbers['map']
+        opcodes = self.numbers['opcode_int']
+        partial = self.numbers['partial_opcode'] != 0
+        if mask is not None:
+            (maps, opcodes, partial) = (maps[mask], opcodes[mask], partial[mask])
+        occupied = np.zeros((max_num_maps, 256), dtype=bool)
+        occupied[maps, opcodes] = True
+        for i in range(1, 8):
+            sel = partial & (opcodes + i < 256)
+            occupied[maps[sel], opcodes[sel] + i] = True
+        return occupied
+
+def encode_categorical(vals: list[Any]) -> tuple[np.ndarray, list[Any]]:
+    val_codes = dict()
+    codes = np.fromiter(( val_codes.setdefault(val, len(val_codes)) for val in vals ), dtype=np.int32, count=len(vals))
+    return (codes, list(val_codes))
+
+def count_operands(operands: Optional[str]) -> int:
+    return len([ opnd for opnd in operands.split() if opnd != 'none' ]) if operands else 0
+
+def make_columns(rows: list[tuple[Any, ...]], attrs: list[str]) -> XedColumns:
+    codes = dict()
+    categories = dict()
+    numbers = dict()
+    for (idx, attr) in enumerate(attrs):
+        vals = [ row[idx] for row in rows ]
+        if attr in categorical_attrs:
+            (codes[attr], categories[attr]) = encode_categorical(vals)
+        elif attr in numeric_attrs:
+            numbers[attr] = np.array([ -1 if val is None else int(val) for val in vals ], dtype=np.int64)
+        else:
+            numbers[f'num_{attr}'] = np.array([ count_operands(val) for val in vals ], dtype=np.int64)
+    return XedColumns(codes, categories, numbers)
+
+def load_sqlite_columns(db_file: str) -> XedColumns:
+    with closing(sqlite3.connect(db_file)) as db:
+        table_columns = [ col[1] for col in db.execute('PRAGMA table_info(Instructions);') ]
+        attrs = [ attr for attr in categorical_attrs + numeric_attrs + operand_attrs if attr in table_columns ]
+        rows = db.execute(f'SELECT {",".join(attrs)} from Instructions;').fetchall()
+    return make_columns(rows, attrs)
+
+def load_snapshot_columns(snapshot_file: str) -> XedColumns:
+    codes = dict()
+    categories = dict()
+    numbers = dict()
+    with XedSnapshot(snapshot_file) as snapshot:
+        for attr in categorical_attrs + numeric_attrs + operand_attrs:
+            if attr not in snapshot.inst_attrs:
+                continue
+            ids = np.frombuffer(snapshot.column_ids(attr), dtype='<u4')
+            (uniq_ids, inverse) = np.unique(ids, return_inverse=True)
+            uniq_vals = [ snapshot.value(int(val_id)) for val_id in uniq_ids ]
+            if attr in categorical_attrs:
+                codes[attr] = inverse.astype(np.int32)
+                categories[attr] = uniq_vals
+            elif attr in numeric_attrs:
+                numbers[attr] = np.array([ -1 if val is None else int(val) for val in uniq_vals ], dtype=np.int64)[inverse]
+            else:
+                numbers[f'num_{attr}'] = np.array([ count_operands(val) for val in uniq_vals ], dtype=np.int64)[inverse]
+            del ids
+    return XedColumns(codes, categories, numbers)
+
+def load_columns(db_file: str) -> XedColumns:
+    if Path(db_file).suffix == '.snap':
+        return load_snapshot_columns(db_file)
+    return load_sqlite_columns(db_file)
+
+def print_counts(title: str, counts: dict[Any, int]) -> None:
+    print(title)
+    for (key, count) in sorted(counts.items(), key=lambda item: (-item[1], str(item[0]))):
+        print(f'{count:8d}  {key}')
+
+report_kinds = ['isa-set', 'occupancy', 'operands']
+
+def main() -> None:
+    parser = ArgumentParser(description='Aggregate reports on a SQLite database (or .snap snapshot) extracted from a XED build')
+    parser.add_argument('xed_sqlite', type=str, help='input SQLite database (or .snap snapshot) extracted from a XED build')
+    parser.add_argument('--report', choices=report_kinds, default='isa-set', help='kind of report (default: isa-set)')
+    parser.add_argument('--space', type=str, help='only count the instruction forms in this encoding space, e.g., evex')
+    args = parser.parse_args()
+    columns = load_columns(args.xed_sqlite)
+    mask = columns.where(space=args.space) if args.space else None
+    if args.report == 'isa-set':
+        print_counts('forms per isa_set:', columns.count_by('isa_set', mask))
+    elif args.report == 'occupancy':
+        occupied = columns.opcode_occupancy(mask)
+        print('populated opcodes per map:')
+        for map_id in range(max_num_maps):
+            if occupied[map_id].any():
+                print(f'{int(occupied[map_id].sum()):8d}  map {map_id}')
+    else:
+        print_counts('forms per number of explicit operands:', columns.count_by('num_explicit_operands', mask))
+
+if __name__ == '__main__':
+    main()
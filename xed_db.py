@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import re
 import csv
 import json
+import textwrap
 import sqlite3
+import pickle
+import hashlib
+import time
+import mmap
+import struct
+from array import array
 from pathlib import Path
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from argparse import ArgumentParser, Namespace
-from typing import Any, List, Tuple, Dict, Optional
+from typing import Any, List, Tuple, Dict, Optional, Callable, Iterable, Iterator
+from xed_profile import (add_profile_argument, start_profile, finish_profile, profile_stage, profile_iter, profile_sink,
+                         profile_enabled, start_worker_profile, worker_profile_stages, merge_profile_stages)
 
 XED_DB = Any
 INST_REC = Any
-XED_DATA = Any
+INST_ROW = Tuple[Any, ...]
+INST_ROWS = Iterator[INST_ROW]
 
 def input_xed_db(dgen: str, pysrc: str) -> XED_DB:
     sys.path.append(pysrc)
@@ -52,11 +66,34 @@ def compute_eosz_list(rec: INST_REC) -> str:
     else:
         return None
 
+re_pattern_constraint = re.compile(r'^(?P<field>[A-Za-z_][A-Za-z0-9_]*)(?P<op>!=|=)(?P<val>.+)$')
+re_pattern_capture = re.compile(r'^(?P<field>[A-Za-z_][A-Za-z0-9_]*)\[(?P<val>[^\]]*)\]$')
+
+PATTERN_CONSTRAINTS = Dict[str, Dict[str, List[str]]]
+
+def parse_pattern_constraints(pattern: str) -> PATTERN_CONSTRAINTS:
+    constraints = dict()
+    for token in pattern.split():
+        m = re_pattern_constraint.match(token)
+        if m:
+            (field, op, val) = (m.group('field'), m.group('op'), m.group('val'))
+        else:
+            m = re_pattern_capture.match(token)
+            if not m:
+                continue
+            (field, op, val) = (m.group('field'), '[]', m.group('val'))
+        vals = constraints.setdefault(field, dict()).setdefault(op, [])
+        if val not in vals:
+            vals.append(val)
+    return constraints
+
+def compute_constraints(pattern: str) -> str:
+    return json.dumps(parse_pattern_constraints(pattern), sort_keys=True, separators=(',', ':'))
+
 def attr_excluded(attr: str) -> bool:
     return attr in ['get_eosz_list'] or attr.startswith('__')
 
 def fix_xed_db(xed_db: XED_DB) -> Tuple[XED_DB, List[str]]:
-    inst_attrs = set([])
     for rec in xed_db.recs:
         rec.opcode_int = rec.opcode_base10
         rec.opcode_hex = compute_opcode_hex(rec.opcode_int)
@@ -65,6 +102,7 @@ def fix_xed_db(xed_db: XED_DB) -> Tuple[XED_DB, List[str]]:
         rec.pp = compute_pp(rec)
         rec.eosz_list = compute_eosz_list(rec)
         rec.pattern = remove_extra_spaces(rec.pattern)
+        rec.constraints = compute_constraints(rec.pattern)
         rec.operands = remove_extra_spaces(rec.operands)
         assert str_of_list(rec.operand_list) == rec.operands
         del rec.operand_list
@@ -76,76 +114,498 @@ def fix_xed_db(xed_db: XED_DB) -> Tuple[XED_DB, List[str]]:
         if hasattr(rec, 'flags'):
             rec.flags = remove_extra_spaces(rec.flags)
         if hasattr(rec, 'comment'):
-            rec.comment = remove_extra_spaces(rec.comment).replace('"', "''")
+            rec.comment = remove_extra_spaces(rec.comment)
         rec.cpuid_fields = str_of_list([ str(r) for g in rec.cpuid_groups for r in g.get_records() ])
         del rec.cpuid_groups
-        for attr in dir(rec):
-            if not attr_excluded(attr):
-                inst_attrs.add(attr)
-    inst_attrs = sorted(list(inst_attrs))
+    inst_attrs = discover_inst_attrs(xed_db.recs)
     print(f'[INFO] number of instrunction defs: {len(xed_db.recs)}')
     print(f'[INFO] instruction attributes: {inst_attrs}')
     return (xed_db, inst_attrs)
 
-def convert_xed_db(xed_db: XED_DB, inst_attrs: List[str]) -> XED_DATA:
+def class_attrs(rec_class: type) -> List[str]:
+    return [ attr for attr in dir(rec_class) if not attr_excluded(attr) ]
+
+def discover_inst_attrs(recs: List[INST_REC]) -> List[str]:
+    inst_attrs = set([])
+    for rec_class in set(map(type, recs)):
+        inst_attrs.update(class_attrs(rec_class))
+    for rec in recs:
+        rec_dict = getattr(rec, '__dict__', None)
+        if rec_dict is None:
+            inst_attrs.update(dir(rec))
+        else:
+            inst_attrs.update(rec_dict)
+    return sorted([ attr for attr in inst_attrs if not attr_excluded(attr) ])
+
+def compile_row_extractor(recs: List[INST_REC], inst_attrs: List[str]) -> Callable[[INST_REC], INST_ROW]:
     from read_xed_db import Restriction
-    inst_list = []
-    for rec in xed_db.recs:
-        inst = {}
-        for attr in inst_attrs:
-            val = getattr(rec, attr, None)
-            assert ( val is None or isinstance(val, bool) or isinstance(val, int) or isinstance(val, str) or
-                     isinstance(val, Restriction) ), val
-            if isinstance(val, Restriction):
-                inst[attr] = val.name
-            else:
-                inst[attr] = val
-        inst_list.append(inst)
-    xed_data = {'Instructions': inst_list}
-    return xed_data
-
-def output_json(xed_data: XED_DATA, json_file: str) -> None:
-    with open(json_file, 'w') as json_fp:
-        json.dump(xed_data, json_fp, sort_keys=True, indent=4)
-
-def output_csv(xed_data: XED_DATA, inst_attrs: List[str], csv_file: str) -> None:
-    with open(csv_file, 'w') as csv_fp:
-        csv_writer = csv.DictWriter(csv_fp, fieldnames=inst_attrs)
-        csv_writer.writeheader()
-        for inst in xed_data['Instructions']:
-            csv_writer.writerow(inst)
-
-def sql_create(table: str, keys: List[str]) -> str:
-    keys_list = ','.join(keys)
-    return f'CREATE TABLE {table} ({keys_list})'
+    rec_classes = set(map(type, recs))
+    shared_attrs = set([ attr for rec_class in rec_classes for attr in class_attrs(rec_class) ])
+    use_dict = all([ hasattr(rec_class, '__dict__') and '__slots__' not in vars(rec_class) for rec_class in rec_classes ])
+    cols = []
+    for attr in inst_attrs:
+        if use_dict and attr not in shared_attrs:
+            read = f'get({attr!r})'
+        else:
+            read = f'getattr(rec, {attr!r}, None)'
+        cols.append(f'(val.name if (val := {read}).__class__ is Restriction else val)')
+    cols_list = ', '.join(cols)
+    get_dict = 'get = rec.__dict__.get; ' if use_dict else ''
+    source = f'def extract_row(rec):\n    {get_dict}return ({cols_list},)\n'
+    namespace = { 'Restriction': Restriction }
+    exec(source, namespace)
+    return namespace['extract_row']
+
+def validate_rec(rec: INST_REC, inst_attrs: List[str]) -> None:
+    from read_xed_db import Restriction
+    for attr in inst_attrs:
+        val = getattr(rec, attr, None)
+        assert ( val is None or isinstance(val, bool) or isinstance(val, int) or isinstance(val, str) or
+                 type(val) is Restriction ), val
+
+def convert_xed_db(xed_db: XED_DB, inst_attrs: List[str], validate: bool = False) -> INST_ROWS:
+    extract_row = compile_row_extractor(xed_db.recs, inst_attrs)
+    if validate:
+        for rec in xed_db.recs:
+            validate_rec(rec, inst_attrs)
+            yield extract_row(rec)
+    else:
+        yield from map(extract_row, xed_db.recs)
+
+class JsonSink:
+
+    def __init__(self, json_file: str, inst_attrs: List[str]):
+        self.inst_attrs = inst_attrs
+        self.json_fp = open(json_file, 'w')
+        self.json_fp.write('{\n    "Instructions": [')
+        self.separator = '\n'
+
+    def write(self, row: INST_ROW) -> None:
+        inst_json = json.dumps(dict(zip(self.inst_attrs, row)), sort_keys=True, indent=4)
+        self.json_fp.write(self.separator + textwrap.indent(inst_json, ' ' * 8))
+        self.separator = ',\n'
+
+    def close(self) -> None:
+        if self.separator == '\n':
+            self.json_fp.write(']\n}')
+        else:
+            self.json_fp.write('\n    ]\n}')
+        self.json_fp.close()
+
+class JsonLinesSink:
+
+    def __init__(self, jsonl_file: str, inst_attrs: List[str]):
+        self.inst_attrs = inst_attrs
+        self.jsonl_fp = open(jsonl_file, 'w')
+
+    def write(self, row: INST_ROW) -> None:
+        self.jsonl_fp.write(json.dumps(dict(zip(self.inst_attrs, row)), sort_keys=True, separators=(',', ':')))
+        self.jsonl_fp.write('\n')
 
-def sql_insert(table: str, keys: List[str], vals: List[Any]) -> str:
+    def close(self) -> None:
+        self.jsonl_fp.close()
+
+class CsvSink:
+
+    def __init__(self, csv_file: str, inst_attrs: List[str]):
+        self.csv_fp = open(csv_file, 'w')
+        self.csv_writer = csv.writer(self.csv_fp)
+        self.csv_writer.writerow(inst_attrs)
+
+    def write(self, row: INST_ROW) -> None:
+        self.csv_writer.writerow(row)
+
+    def close(self) -> None:
+        self.csv_fp.close()
+
+sql_column_types = {
+    'category': 'TEXT',
+    'constraints': 'TEXT',
+    'cpuid_fields': 'TEXT',
+    'explicit_operands': 'TEXT',
+    'extension': 'TEXT',
+    'iclass': 'TEXT',
+    'implicit_operands': 'TEXT',
+    'isa_set': 'TEXT',
+    'map': 'INTEGER',
+    'opcode_hex': 'TEXT',
+    'opcode_int': 'INTEGER',
+    'operands': 'TEXT',
+    'partial_opcode': 'INTEGER',
+    'pattern': 'TEXT',
+    'pp': 'TEXT',
+    'space': 'TEXT',
+}
+
+sql_lookup_tables = {
+    'category': 'Categories',
+    'cpuid_fields': 'CpuidFields',
+    'extension': 'Extensions',
+    'iclass': 'Iclasses',
+    'isa_set': 'IsaSets',
+}
+
+sql_indexes = {
+    'idx_map_opcode_iclass': ['map', 'opcode_int', 'iclass'],
+    'idx_iclass': ['iclass'],
+    'idx_extension': ['extension'],
+    'idx_isa_set': ['isa_set'],
+}
+
+sqlite_bulk_pragmas = [
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA temp_store = MEMORY',
+]
+
+def sql_column(key: str) -> str:
+    col_type = sql_column_types.get(key, None)
+    return f'{key} {col_type}' if col_type else key
+
+def sql_lookup_column(key: str) -> str:
+    if key in sql_lookup_tables:
+        return f'{key}_id'
+    else:
+        return key
+
+def sql_create(table: str, cols: List[str]) -> str:
+    cols_list = ','.join(cols)
+    return f'CREATE TABLE {table} ({cols_list})'
+
+def sql_insert(table: str, keys: List[str]) -> str:
     keys_list = ','.join(keys)
-    vals_list = ','.join(vals)
-    return f'INSERT INTO {table} ({keys_list}) VALUES ({vals_list})'
+    params_list = ','.join([ '?' for key in keys ])
+    return f'INSERT INTO {table} ({keys_list}) VALUES ({params_list})'
 
-def sql_insert_inst(inst: Dict[str, Optional[int | str]], inst_attrs: List[str]) -> str:
-    inst_vals = []
-    for attr in inst_attrs:
-        val = inst[attr]
-        if isinstance(val, int):
-            inst_vals.append(str(val))
-        elif isinstance(val, str):
-            inst_vals.append('"' + val + '"')
+def sql_create_view(view: str, table: str, keys: List[str]) -> str:
+    cols = []
+    joins = []
+    for key in keys:
+        lookup_table = sql_lookup_tables.get(key, None)
+        if lookup_table:
+            cols.append(f'{lookup_table}.name AS {key}')
+            joins.append(f' LEFT JOIN {lookup_table} ON {lookup_table}.id = {table}.{key}_id')
         else:
-            assert val is None
-            inst_vals.append('NULL')
-    return sql_insert('Instructions', inst_attrs, inst_vals)
+            cols.append(f'{table}.{key} AS {key}')
+    cols_list = ','.join(cols)
+    joins_list = ''.join(joins)
+    return f'CREATE VIEW {view} AS SELECT {cols_list} FROM {table}{joins_list}'
 
-def output_sqlite(xed_data: XED_DATA, inst_attrs: List[str], sqlite_file: str) -> None:
-    sqlite_path = Path(sqlite_file)
-    sqlite_path.unlink(missing_ok=True)
-    with sqlite3.connect(sqlite_path) as sqlite_db:
-        create_cmd = sql_create('Instructions', inst_attrs)
-        sqlite_db.execute(create_cmd)
-        for inst in xed_data['Instructions']:
-            insert_cmd = sql_insert_inst(inst, inst_attrs)
-            sqlite_db.execute(insert_cmd)
+def sql_create_indexes(table: str, keys: List[str]) -> List[str]:
+    index_cmds = []
+    for index, index_keys in sql_indexes.items():
+        if all([ (key in keys) for key in index_keys ]):
+            cols_list = ','.join([ sql_lookup_column(key) for key in index_keys ])
+            index_cmds.append(f'CREATE INDEX {index} ON {table} ({cols_list})')
+    return index_cmds
+
+def sql_create_lookup_indexes(lookup_tables: List[str]) -> List[str]:
+    return [ f'CREATE UNIQUE INDEX idx_{lookup_table.lower()}_name ON {lookup_table} (name)' for lookup_table in lookup_tables ]
+
+def lookup_id(lookup: Dict[str, int], val: Optional[str]) -> Optional[int]:
+    if val is None:
+        return None
+    return lookup.setdefault(val, len(lookup) + 1)
+
+sqlite_batch_size = 10000
+
+class SqliteSink:
+
+    def __init__(self, sqlite_file: str, inst_attrs: List[str], normalize: bool = False):
+        sqlite_path = Path(sqlite_file)
+        sqlite_path.unlink(missing_ok=True)
+        self.inst_attrs = inst_attrs
+        self.sqlite_db = sqlite3.connect(sqlite_path, isolation_level=None)
+        for pragma in sqlite_bulk_pragmas:
+            self.sqlite_db.execute(pragma)
+        self.sqlite_db.execute('BEGIN')
+        self.lookups = { idx: dict() for idx, attr in enumerate(inst_attrs) if normalize and attr in sql_lookup_tables }
+        if normalize:
+            for idx in self.lookups:
+                lookup_table = sql_lookup_tables[inst_attrs[idx]]
+                self.sqlite_db.execute(sql_create(lookup_table, ['id INTEGER PRIMARY KEY', 'name TEXT']))
+            def_cols = [ f'{attr}_id INTEGER REFERENCES {sql_lookup_tables[attr]}(id)' if idx in self.lookups else sql_column(attr)
+                         for idx, attr in enumerate(inst_attrs) ]
+            self.sqlite_db.execute(sql_create('InstructionDefs', def_cols))
+            self.insert_cmd = sql_insert('InstructionDefs', [ sql_lookup_column(attr) for attr in inst_attrs ])
+        else:
+            self.sqlite_db.execute(sql_create('Instructions', [ sql_column(attr) for attr in inst_attrs ]))
+            self.insert_cmd = sql_insert('Instructions', inst_attrs)
+        self.normalize = normalize
+        self.batch = []
+
+    def write(self, row: INST_ROW) -> None:
+        if self.lookups:
+            row = [ lookup_id(self.lookups[idx], val) if idx in self.lookups else val for idx, val in enumerate(row) ]
+        self.batch.append(row)
+        if len(self.batch) >= sqlite_batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.sqlite_db.executemany(self.insert_cmd, self.batch)
+        self.batch = []
+
+    def finish_normalized(self) -> None:
+        for idx, lookup in self.lookups.items():
+            insert_cmd = sql_insert(sql_lookup_tables[self.inst_attrs[idx]], ['id', 'name'])
+            self.sqlite_db.executemany(insert_cmd, [ (name_id, name) for name, name_id in lookup.items() ])
+        self.sqlite_db.execute(sql_create_view('Instructions', 'InstructionDefs', self.inst_attrs))
+        lookup_tables = [ sql_lookup_tables[self.inst_attrs[idx]] for idx in self.lookups ]
+        for index_cmd in sql_create_indexes('InstructionDefs', self.inst_attrs) + sql_create_lookup_indexes(lookup_tables):
+            self.sqlite_db.execute(index_cmd)
+        self.sqlite_db.execute('ANALYZE')
+
+    def close(self) -> None:
+        self.flush()
+        if self.normalize:
+            self.finish_normalized()
+        self.sqlite_db.execute('COMMIT')
+        self.sqlite_db.close()
+
+snapshot_magic = b'XEDSNAP\0'
+snapshot_version = 1
+snapshot_header = struct.Struct('<8sIIIII')
+
+def snapshot_array(xs: array) -> bytes:
+    assert xs.itemsize == 4
+    if sys.byteorder == 'big':
+        xs = array(xs.typecode, xs)
+        xs.byteswap()
+    return xs.tobytes()
+
+class SnapshotSink:
+
+    def __init__(self, snapshot_file: str, inst_attrs: List[str]):
+        self.snapshot_path = Path(snapshot_file)
+        self.inst_attrs = inst_attrs
+        self.columns = [ array('I') for attr in inst_attrs ]
+        self.value_ids = dict()
+        self.values = []
+
+    def write(self, row: INST_ROW) -> None:
+        for (column, val) in zip(self.columns, row):
+            key = (type(val), val)
+            val_id = self.value_ids.get(key, None)
+            if val_id is None:
+                val_id = len(self.values)
+                self.value_ids[key] = val_id
+                self.values.append(json.dumps(val).encode())
+            column.append(val_id)
+
+    def close(self) -> None:
+        attrs_json = json.dumps(self.inst_attrs).encode()
+        attrs_json += b' ' * (-len(attrs_json) % 4)
+        value_offsets = array('I', [0])
+        for val in self.values:
+            value_offsets.append(value_offsets[-1] + len(val))
+        num_rows = len(self.columns[0]) if self.columns else 0
+        tmp_path = self.snapshot_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as snapshot_fp:
+            snapshot_fp.write(snapshot_header.pack(snapshot_magic, snapshot_version, len(attrs_json),
+                                                   len(self.inst_attrs), num_rows, len(self.values)))
+            snapshot_fp.write(attrs_json)
+            for column in self.columns:
+                snapshot_fp.write(snapshot_array(column))
+            snapshot_fp.write(snapshot_array(value_offsets))
+            snapshot_fp.writelines(self.values)
+        tmp_path.replace(self.snapshot_path)
+
+class XedSnapshot:
+
+    def __init__(self, snapshot_file: str):
+        if sys.byteorder != 'little':
+            raise ValueError('XED snapshots can only be read on little-endian hosts')
+        with open(snapshot_file, 'rb') as snapshot_fp:
+            self.snapshot = mmap.mmap(snapshot_fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (num_rows, num_values, offset) = self.read_header(snapshot_file)
+        except Exception:
+            self.snapshot.close()
+            raise
+        self.view = memoryview(self.snapshot)
+        self.columns = []
+        for attr in self.inst_attrs:
+            self.columns.append(self.view[offset:offset + 4 * num_rows].cast('I'))
+            offset += 4 * num_rows
+        self.value_offsets = self.view[offset:offset + 4 * (num_values + 1)].cast('I')
+        self.values_offset = offset + 4 * (num_values + 1)
+        self.num_rows = num_rows
+        self.decoded = dict()
+
+    def read_header(self, snapshot_file: str) -> Tuple[int, int, int]:
+        if len(self.snapshot) < snapshot_header.size:
+            raise ValueError(f'not a XED snapshot: {snapshot_file}')
+        (magic, version, attrs_len, num_attrs, num_rows, num_values) = snapshot_header.unpack_from(self.snapshot, 0)
+        if magic != snapshot_magic:
+            raise ValueError(f'not a XED snapshot: {snapshot_file}')
+        if version != snapshot_version:
+            raise ValueError(f'unsupported XED snapshot version: {version}')
+        offset = snapshot_header.size
+        self.inst_attrs = json.loads(self.snapshot[offset:offset + attrs_len])
+        if len(self.inst_attrs) != num_attrs:
+            raise ValueError(f'corrupt XED snapshot: {snapshot_file}')
+        offset += attrs_len
+        if len(self.snapshot) < offset + 4 * (num_attrs * num_rows + num_values + 1):
+            raise ValueError(f'truncated XED snapshot: {snapshot_file}')
+        return (num_rows, num_values, offset)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __enter__(self) -> 'XedSnapshot':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def value(self, val_id: int) -> Any:
+        try:
+            return self.decoded[val_id]
+        except KeyError:
+            start = self.values_offset + self.value_offsets[val_id]
+            end = self.values_offset + self.value_offsets[val_id + 1]
+            val = json.loads(self.snapshot[start:end])
+            self.decoded[val_id] = val
+            return val
+
+    def column_ids(self, attr: str) -> memoryview:
+        return self.columns[self.inst_attrs.index(attr)]
+
+    def distinct_values(self, attr: str) -> List[Any]:
+        return [ self.value(val_id) for val_id in dict.fromkeys(self.column_ids(attr)) ]
+
+    def row(self, idx: int) -> INST_ROW:
+        return tuple([ self.value(column[idx]) for column in self.columns ])
+
+    def iter_rows(self) -> INST_ROWS:
+        value = self.value
+        for row_ids in zip(*self.columns):
+            yield tuple([ value(val_id) for val_id in row_ids ])
+
+    def close(self) -> None:
+        for column in self.columns:
+            column.release()
+        self.value_offsets.release()
+        self.view.release()
+        self.snapshot.close()
+
+INST_SINK = JsonSink | JsonLinesSink | CsvSink | SqliteSink | SnapshotSink
+
+def output_rows(rows: Iterable[INST_ROW], sinks: List[INST_SINK]) -> None:
+    for row in rows:
+        for sink in sinks:
+            sink.write(row)
+    for sink in sinks:
+        sink.close()
+
+def make_json_sink(json_file: str, inst_attrs: List[str]) -> JsonSink | JsonLinesSink:
+    if Path(json_file).suffix == '.jsonl':
+        return JsonLinesSink(json_file, inst_attrs)
+    else:
+        return JsonSink(json_file, inst_attrs)
+
+def open_sink(kind: str, out_file: str, inst_attrs: List[str], normalize: bool = False) -> INST_SINK:
+    if kind == 'json':
+        return make_json_sink(out_file, inst_attrs)
+    if kind == 'csv':
+        return CsvSink(out_file, inst_attrs)
+    if kind == 'snapshot':
+        return SnapshotSink(out_file, inst_attrs)
+    assert kind == 'sqlite', kind
+    return SqliteSink(out_file, inst_attrs, normalize)
+
+def output_json(rows: Iterable[INST_ROW], inst_attrs: List[str], json_file: str) -> None:
+    output_rows(rows, [open_sink('json', json_file, inst_attrs)])
+
+def output_csv(rows: Iterable[INST_ROW], inst_attrs: List[str], csv_file: str) -> None:
+    output_rows(rows, [open_sink('csv', csv_file, inst_attrs)])
+
+def output_sqlite(rows: Iterable[INST_ROW], inst_attrs: List[str], sqlite_file: str, normalize: bool = False) -> None:
+    output_rows(rows, [open_sink('sqlite', sqlite_file, inst_attrs, normalize)])
+
+def time_sink(kind: str, out_file: str, inst_attrs: List[str], normalize: bool, rows: Tuple[INST_ROW, ...]) -> float:
+    start_time = time.perf_counter()
+    output_rows(rows, [open_sink(kind, out_file, inst_attrs, normalize)])
+    return time.perf_counter() - start_time
+
+def output_rows_parallel(rows: Iterable[INST_ROW], inst_attrs: List[str], outputs: List[Tuple[str, str]],
+                         normalize: bool, pool_kind: str) -> None:
+    start_time = time.perf_counter()
+    rows = tuple(rows)
+    print(f'[INFO] input: {len(rows)} rows in {time.perf_counter() - start_time:.3f}s')
+    pool_class = ThreadPoolExecutor if pool_kind == 'thread' else ProcessPoolExecutor
+    with pool_class(max_workers=max(1, len(outputs))) as pool:
+        futures = [ pool.submit(time_sink, kind, out_file, inst_attrs, normalize, rows) for (kind, out_file) in outputs ]
+        for ((kind, out_file), future) in zip(outputs, futures):
+            print(f'[INFO] {kind} output {out_file}: {future.result():.3f}s')
+    print(f'[INFO] total: {time.perf_counter() - start_time:.3f}s')
+
+xed_cache_version = 2
+xed_cache_chunk_size = 10000
+
+def hash_file(path: Path) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def hash_tree(root: str, pattern: str) -> Dict[str, str]:
+    root_path = Path(root)
+    return { str(path.relative_to(root_path)): hash_file(path)
+             for path in sorted(root_path.rglob(pattern)) if path.is_file() }
+
+def compute_cache_key(dgen: str, pysrc: str) -> str:
+    key_info = {
+        'version': xed_cache_version,
+        'xed_db': hash_file(Path(__file__)),
+        'dgen': hash_tree(dgen, '*'),
+        'pysrc': hash_tree(pysrc, '*.py'),
+    }
+    key_json = json.dumps(key_info, sort_keys=True)
+    return hashlib.sha256(key_json.encode()).hexdigest()
+
+def input_xed_rows(dgen: str, pysrc: str, validate: bool = False) -> Tuple[INST_ROWS, List[str]]:
+    with profile_stage('input'):
+        xed_db = input_xed_db(dgen, pysrc)
+    with profile_stage('fix', len(xed_db.recs)):
+        (xed_db, inst_attrs) = fix_xed_db(xed_db)
+    return (profile_iter('convert', convert_xed_db(xed_db, inst_attrs, validate)), inst_attrs)
+
+def read_cache_rows(cache_fp: Any) -> INST_ROWS:
+    with cache_fp:
+        while True:
+            try:
+                chunk = pickle.load(cache_fp)
+            except EOFError:
+                return
+            yield from chunk
+
+def write_cache_rows(rows: INST_ROWS, inst_attrs: List[str], cache_path: Path) -> INST_ROWS:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as cache_fp:
+        pickle.dump(inst_attrs, cache_fp, protocol=pickle.HIGHEST_PROTOCOL)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            yield row
+            if len(chunk) >= xed_cache_chunk_size:
+                pickle.dump(chunk, cache_fp, protocol=pickle.HIGHEST_PROTOCOL)
+                chunk = []
+        if chunk:
+            pickle.dump(chunk, cache_fp, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(cache_path)
+
+def input_cached_xed_rows(dgen: str, pysrc: str, cache_dir: str, validate: bool = False) -> Tuple[INST_ROWS, List[str]]:
+    cache_path = Path(cache_dir) / f'{compute_cache_key(dgen, pysrc)}.pickle'
+    if cache_path.exists():
+        cache_fp = open(cache_path, 'rb')
+        inst_attrs = pickle.load(cache_fp)
+        print(f'[INFO] using cached instruction defs: {cache_path}')
+        return (profile_iter('cache read', read_cache_rows(cache_fp)), inst_attrs)
+    (rows, inst_attrs) = input_xed_rows(dgen, pysrc, validate)
+    return (write_cache_rows(rows, inst_attrs, cache_path), inst_attrs)
 
 default_root = Path(__file__).resolve().parent.parent
 default_dgen = str(default_root / 'build/obj/dgen')
@@ -154,30 +614,117 @@ default_pysrc = str(default_root / 'xed/pysrc')
 def process_args() -> Namespace:
     parser = ArgumentParser(description='Extract a database from a XED build')
     parser.add_argument('--dgen', default=default_dgen, help=f'the dgen directory of a XED build (default: {default_dgen})')
+    parser.add_argument('--config', action='append', metavar='NAME=DGEN',
+                        help='a named dgen directory of one XED build configuration (may be repeated; overrides --dgen)')
     parser.add_argument('--pysrc', default=default_pysrc, help=f'pathname of xed/pysrc (default: {default_pysrc})')
+    parser.add_argument('--cache-dir', type=str,
+                        help='directory caching the instruction defs, keyed by the contents of the dgen and pysrc files')
     parser.add_argument('-c', '--csv', type=str, help='output CSV file')
-    parser.add_argument('-j', '--json', type=str, help='output JSON file')
+    parser.add_argument('-j', '--json', type=str, help='output JSON file (JSON Lines if the suffix is .jsonl)')
     parser.add_argument('-s', '--sqlite', type=str, help='output SQLite database')
+    parser.add_argument('-b', '--snapshot', type=str,
+                        help='output binary snapshot of interned column arrays, memory-mapped by XedSnapshot')
+    parser.add_argument('--normalize', action='store_true',
+                        help='store repeated strings of the SQLite database in indexed lookup tables behind an Instructions view')
+    parser.add_argument('--parallel', choices=['thread', 'process'],
+                        help=('write the outputs concurrently in a thread or process pool and report per-output timings '
+                              '(thread is recommended; process pickles all the rows for each output)'))
+    parser.add_argument('--validate', action='store_true',
+                        help='check the type of every attribute value of every instruction def while converting them')
+    add_profile_argument(parser)
     args = parser.parse_args()
     if args.csv:
         assert Path(args.csv).suffix == '.csv'
     if args.json:
-        assert Path(args.json).suffix == '.json'
+        assert Path(args.json).suffix in ['.json', '.jsonl']
     if args.sqlite:
         assert Path(args.sqlite).suffix == '.db'
+    if args.snapshot:
+        assert Path(args.snapshot).suffix == '.snap'
     return args
 
+def requested_outputs(args: Namespace) -> List[Tuple[str, str]]:
+    outputs = [ ('json', args.json), ('csv', args.csv), ('sqlite', args.sqlite), ('snapshot', args.snapshot) ]
+    return [ (kind, out_file) for (kind, out_file) in outputs if out_file ]
+
+def export_xed(dgen: str, pysrc: str, cache_dir: Optional[str], outputs: List[Tuple[str, str]],
+               normalize: bool, parallel: Optional[str], validate: bool = False) -> List[str]:
+    if cache_dir:
+        (rows, inst_attrs) = input_cached_xed_rows(dgen, pysrc, cache_dir, validate)
+    else:
+        (rows, inst_attrs) = input_xed_rows(dgen, pysrc, validate)
+    if parallel:
+        with profile_stage('output parallel'):
+            output_rows_parallel(rows, inst_attrs, outputs, normalize, parallel)
+    else:
+        output_rows(rows, [ profile_sink(f'output {kind}', open_sink(kind, out_file, inst_attrs, normalize))
+                            for (kind, out_file) in outputs ])
+    return inst_attrs
+
+def config_output(out_file: str, config: str) -> str:
+    out_path = Path(out_file)
+    return str(out_path.with_name(f'{out_path.stem}.{config}{out_path.suffix}'))
+
+def parse_configs(config_specs: List[str]) -> List[Tuple[str, str]]:
+    configs = []
+    for config_spec in config_specs:
+        (config, _, dgen) = config_spec.partition('=')
+        assert config and dgen, f'bad configuration: {config_spec}'
+        configs.append((config, dgen))
+    assert len(set([ config for (config, _) in configs ])) == len(configs), 'duplicate configuration names'
+    return configs
+
+def combine_sqlite(config_dbs: List[Tuple[str, str, List[str]]], sqlite_file: str) -> None:
+    all_attrs = sorted(set([ attr for (_, _, inst_attrs) in config_dbs for attr in inst_attrs ]))
+    sqlite_path = Path(sqlite_file)
+    sqlite_path.unlink(missing_ok=True)
+    with closing(sqlite3.connect(sqlite_path, isolation_level=None)) as sqlite_db:
+        for pragma in sqlite_bulk_pragmas:
+            sqlite_db.execute(pragma)
+        sqlite_db.execute(sql_create('Instructions', ['config TEXT'] + [ sql_column(attr) for attr in all_attrs ]))
+        for (config, config_file, inst_attrs) in config_dbs:
+            keys_list = ','.join(inst_attrs)
+            sqlite_db.execute('ATTACH DATABASE ? AS config_db', (config_file,))
+            with sqlite_db:
+                sqlite_db.execute('BEGIN')
+                sqlite_db.execute(f'INSERT INTO Instructions (config,{keys_list}) SELECT ?,{keys_list} FROM config_db.Instructions',
+                                  (config,))
+            sqlite_db.execute('DETACH DATABASE config_db')
+        sqlite_db.execute('CREATE INDEX idx_config_map_opcode_iclass ON Instructions (config,map,opcode_int,iclass)')
+
+def export_xed_config(profiling: bool, dgen: str, pysrc: str, cache_dir: Optional[str], outputs: List[Tuple[str, str]],
+                      normalize: bool, parallel: Optional[str], validate: bool) -> Tuple[List[str], List[Dict[str, Any]]]:
+    start_worker_profile(profiling)
+    inst_attrs = export_xed(dgen, pysrc, cache_dir, outputs, normalize, parallel, validate)
+    return (inst_attrs, worker_profile_stages())
+
+def export_xed_configs(configs: List[Tuple[str, str]], args: Namespace) -> None:
+    outputs = requested_outputs(args)
+    with profile_stage('export configs'), ProcessPoolExecutor(max_workers=min(len(configs), os.cpu_count() or 1)) as pool:
+        futures = [ pool.submit(export_xed_config, profile_enabled(), dgen, args.pysrc, args.cache_dir,
+                                [ (kind, config_output(out_file, config)) for (kind, out_file) in outputs ],
+                                args.normalize, args.parallel, args.validate)
+                    for (config, dgen) in configs ]
+        config_attrs = []
+        for ((config, _), future) in zip(configs, futures):
+            (inst_attrs, stages) = future.result()
+            merge_profile_stages(config, stages)
+            config_attrs.append(inst_attrs)
+    if args.sqlite:
+        config_dbs = [ (config, config_output(args.sqlite, config), inst_attrs)
+                       for ((config, _), inst_attrs) in zip(configs, config_attrs) ]
+        with profile_stage('combine sqlite'):
+            combine_sqlite(config_dbs, args.sqlite)
+
 def main() -> None:
     args = process_args()
-    xed_db = input_xed_db(args.dgen, args.pysrc)
-    (xed_db, inst_attrs) = fix_xed_db(xed_db)
-    xed_data = convert_xed_db(xed_db, inst_attrs)
-    if args.json:
-        output_json(xed_data, args.json)
-    if args.csv:
-        output_csv(xed_data, inst_attrs, args.csv)
-    if args.sqlite:
-        output_sqlite(xed_data, inst_attrs, args.sqlite)
+    start_profile(args.profile)
+    if args.config:
+        export_xed_configs(parse_configs(args.config), args)
+    else:
+        export_xed(args.dgen, args.pysrc, args.cache_dir, requested_outputs(args), args.normalize, args.parallel,
+                   args.validate)
+    finish_profile()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import mmap
+from collections import Counter
+from argparse import ArgumentParser
+from typing import Iterable, Iterator, Optional
+from xed_opcode_map import (AllOpcodeMaps, Iclass, InstDef, Space, Mode, Mod, Vl, reg_rm_any, rm_dups,
+                            collect_all_maps, input_sqlite_db, max_num_maps)
+
+pp_values = ['NP', '66', 'F3', 'F2']
+
+decode_modes = {
+    16: Mode.MODE16,
+    32: Mode.MODE32,
+    64: Mode.MODE64,
+}
+
+vex_vls = [Vl.VL128, Vl.VL256]
+evex_vls = [Vl.VL128, Vl.VL256, Vl.VL512, Vl.VL512]
+
+segment_prefixes = frozenset([0x2E, 0x36, 0x3E, 0x26, 0x64, 0x65])
+
+max_inst_len = 15
+
+DecodeKey = tuple[Space, int, int, str]
+DecodeEntry = tuple[Mode, Vl, Optional[int], Iclass]
+DecodeTable = dict[DecodeKey, list[tuple[DecodeEntry, ...]]]
+NoModrmKeys = frozenset[DecodeKey]
+Encoding = tuple[Space, int, int, str, int, Vl, int]
+
+def modrm_matches(inst: InstDef, modrm: int) -> bool:
+    mod = modrm >> 6
+    reg = (modrm >> 3) & 7
+    rm = modrm & 7
+    if inst.mod == Mod.NOT3:
+        if mod == 3:
+            return False
+    elif inst.mod != Mod.ANY and inst.mod != mod:
+        return False
+    if inst.reg != reg_rm_any and inst.reg != reg:
+        return False
+    if inst.rm != reg_rm_any and inst.rm != rm:
+        return False
+    return True
+
+def make_decode_entry(inst: InstDef) -> DecodeEntry:
+    if inst.rexw_prefix in ['0', '1']:
+        rexw = int(inst.rexw_prefix)
+    else:
+        rexw = None
+    return (inst.mode, inst.vl, rexw, inst.iclass)
+
+def make_decode_table(all_maps: AllOpcodeMaps) -> tuple[DecodeTable, NoModrmKeys]:
+    key_entries = dict()
+    for map_id in range(max_num_maps):
+        for opcode in range(256):
+            for iclass_defs in all_maps[map_id][opcode].values():
+                for inst in iclass_defs:
+                    if inst.space == Space.LEGACY and map_id == 4:
+                        continue
+                    for pp in inst.pp.split() or pp_values:
+                        key = (inst.space, map_id, opcode, pp)
+                        key_entries.setdefault(key, []).append(inst)
+    interned = dict()
+    decode_table = dict()
+    no_modrm_keys = set()
+    for (key, insts) in key_entries.items():
+        if not any([ inst.has_modrm for inst in insts ]):
+            entries = tuple(rm_dups([ make_decode_entry(inst) for inst in insts ]))
+            decode_table[key] = [ interned.setdefault(entries, entries) ]
+            no_modrm_keys.add(key)
+            continue
+        modrm_entries = []
+        for modrm in range(256):
+            entries = tuple(rm_dups([ make_decode_entry(inst) for inst in insts if modrm_matches(inst, modrm) ]))
+            modrm_entries.append(interned.setdefault(entries, entries))
+        decode_table[key] = modrm_entries
+    return (decode_table, frozenset(no_modrm_keys))
+
+def entry_matches(entry: DecodeEntry, mode: Mode, vl: Vl, rexw: int) -> bool:
+    (inst_mode, inst_vl, inst_rexw, _) = entry
+    if inst_mode == Mode.NOT64:
+        if mode == Mode.MODE64:
+            return False
+    elif inst_mode != Mode.ANY and inst_mode != mode:
+        return False
+    if inst_vl not in [Vl.NA, Vl.LIG] and inst_vl != vl:
+        return False
+    if inst_rexw is not None and inst_rexw != rexw:
+        return False
+    return True
+
+def legacy_pp(osz: bool, rep: int) -> str:
+    if rep == 0xF2:
+        return 'F2'
+    if rep == 0xF3:
+        return 'F3'
+    if osz:
+        return '66'
+    return 'NP'
+
+def parse_encoding(data: bytes, mode: Mode = Mode.MODE64,
+                   no_modrm_keys: NoModrmKeys = frozenset()) -> Optional[tuple[Encoding, int]]:
+    n = min(len(data), max_inst_len)
+    i = 0
+    osz = False
+    rep = 0
+    rexw = 0
+    while i < n:
+        b = data[i]
+        if b == 0x66:
+            osz = True
+        elif b in [0xF2, 0xF3]:
+            rep = b
+        elif b in [0x67, 0xF0] or b in segment_prefixes:
+            pass
+        else:
+            break
+        rexw = 0
+        i += 1
+    if mode == Mode.MODE64:
+        while i < n and 0x40 <= data[i] <= 0x4F:
+            rexw = (data[i] >> 3) & 1
+            i += 1
+    if i >= n:
+        return None
+    b = data[i]
+    if i + 1 < n and (b in [0xC4, 0xC5, 0x62] and (mode == Mode.MODE64 or data[i + 1] >= 0xC0) or
+                      b == 0x8F and data[i + 1] & 0x1F >= 8):
+        p0 = data[i + 1]
+        if b == 0xC5:
+            (space, map_id, rexw, vl, pp, i) = (Space.VEX, 1, 0, vex_vls[(p0 >> 2) & 1], p0 & 3, i + 2)
+        elif i + 2 >= n:
+            return None
+        elif b == 0x62:
+            if i + 3 >= n:
+                return None
+            (p1, p2) = (data[i + 2], data[i + 3])
+            (space, map_id, rexw, vl, pp, i) = (Space.EVEX, p0 & 7, p1 >> 7, evex_vls[(p2 >> 5) & 3], p1 & 3, i + 4)
+        else:
+            p1 = data[i + 2]
+            space = Space.VEX if b == 0xC4 else Space.XOP
+            (map_id, rexw, vl, pp, i) = (p0 & 0x1F, p1 >> 7, vex_vls[(p1 >> 2) & 1], p1 & 3, i + 3)
+        if i >= n or map_id >= max_num_maps:
+            return None
+        pp = pp_values[pp]
+    else:
+        space = Space.LEGACY
+        vl = Vl.NA
+        pp = legacy_pp(osz, rep)
+        map_id = 0
+        if mode == Mode.MODE64 and b == 0xD5:
+            if i + 1 >= n:
+                return None
+            rex2 = data[i + 1]
+            (map_id, rexw, i) = (rex2 >> 7, (rex2 >> 3) & 1, i + 2)
+        elif b == 0x0F:
+            i += 1
+            map_id = 1
+            if i < n and data[i] == 0x38:
+                (map_id, i) = (2, i + 1)
+            elif i < n and data[i] == 0x3A:
+                (map_id, i) = (3, i + 1)
+            elif i < n and data[i] == 0x0F:
+                return None
+        if i >= n:
+            return None
+    if (space, map_id, data[i], pp) in no_modrm_keys:
+        return ((space, map_id, data[i], pp, 0, vl, rexw), i + 1)
+    if i + 1 >= n:
+        return None
+    return ((space, map_id, data[i], pp, data[i + 1], vl, rexw), i + 2)
+
+class DecodeIndex:
+
+    __slots__ = ('table', 'no_modrm_keys', 'mode', 'memo', 'trie')
+
+    def __init__(self, table: DecodeTable, no_modrm_keys: NoModrmKeys, mode: Mode = Mode.MODE64):
+        self.table = table
+        self.no_modrm_keys = no_modrm_keys
+        self.mode = mode
+        self.memo = dict()
+        self.trie = dict()
+
+    def lookup_encoding(self, encoding: Encoding) -> tuple[Iclass, ...]:
+        iclasses = self.memo.get(encoding, None)
+        if iclasses is None:
+            (space, map_id, opcode, pp, modrm, vl, rexw) = encoding
+            modrm_entries = self.table.get((space, map_id, opcode, pp), None)
+            if modrm_entries is None:
+                iclasses = ()
+            else:
+                iclasses = tuple(rm_dups([ entry[3] for entry in modrm_entries[modrm]
+                                           if entry_matches(entry, self.mode, vl, rexw) ]))
+            self.memo[encoding] = iclasses
+        return iclasses
+
+    def lookup(self, data: bytes) -> tuple[Iclass, ...]:
+        node = self.trie
+        for b in data:
+            node = node.get(b, None)
+            if node is None:
+                break
+            if type(node) is tuple:
+                return node
+        parsed = parse_encoding(data, self.mode, self.no_modrm_keys)
+        if parsed is None:
+            return ()
+        (encoding, length) = parsed
+        iclasses = self.lookup_encoding(encoding)
+        node = self.trie
+        for b in data[:length - 1]:
+            node = node.setdefault(b, dict())
+        node[data[length - 1]] = iclasses
+        return iclasses
+
+    def lookup_many(self, datas: Iterable[bytes]) -> Iterator[tuple[Iclass, ...]]:
+        lookup = self.lookup
+        for data in datas:
+            yield lookup(data)
+
+def make_decode_index(db_file: str, mode: Mode = Mode.MODE64) -> DecodeIndex:
+    all_maps = collect_all_maps(input_sqlite_db(db_file))
+    (table, no_modrm_keys) = make_decode_table(all_maps)
+    return DecodeIndex(table, no_modrm_keys, mode)
+
+def iter_trace_records(trace_file: str, record_size: int) -> Iterator[bytes]:
+    with open(trace_file, 'rb') as trace_fp:
+        with mmap.mmap(trace_fp.fileno(), 0, access=mmap.ACCESS_READ) as trace:
+            for offset in range(0, len(trace) - record_size + 1, record_size):
+                yield trace[offset:offset + record_size]
+
+def classify_trace(index: DecodeIndex, trace_file: str, record_size: int = max_inst_len) -> Counter:
+    counts = Counter()
+    for iclasses in index.lookup_many(iter_trace_records(trace_file, record_size)):
+        counts[iclasses] += 1
+    return counts
+
+def main() -> None:
+    parser = ArgumentParser(description='Look up the iclasses matching instruction byte sequences in a SQLite database extracted from a XED build')
+    parser.add_argument('xed_sqlite', type=str, help='input SQLite database extracted from a XED build')
+    parser.add_argument('hex_bytes', type=str, nargs='*', help='instruction bytes in hex, e.g., 62f27d484fc1')
+    parser.add_argument('--mode', type=int, choices=sorted(decode_modes), default=64, help='machine mode (default: 64)')
+    parser.add_argument('--trace', type=str,
+                        help='trace file of fixed-size records, each holding the bytes of one instruction')
+    parser.add_argument('--record-size', type=int, default=max_inst_len,
+                        help=f'size in bytes of each record in the trace file (default: {max_inst_len})')
+    args = parser.parse_args()
+    index = make_decode_index(args.xed_sqlite, decode_modes[args.mode])
+    for hex_bytes in args.hex_bytes:
+        iclasses = index.lookup(bytes.fromhex(hex_bytes))
+        print(f'{hex_bytes}: {" ".join(iclasses) or "?"}')
+    if args.trace:
+        counts = classify_trace(index, args.trace, args.record_size)
+        for (iclasses, count) in counts.most_common():
+            print(f'{count}\t{" ".join(iclasses) or "?"}')
+
+if __name__ == '__main__':
+    main()
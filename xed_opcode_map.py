@@ -1,28 +1,169 @@
 #!/usr/bin/env python3
 
 import sys
-import re
 import json
+import hashlib
+import itertools
 import sqlite3
+from enum import IntEnum
+from functools import cache
 from pathlib import Path
+from contextlib import closing
 from argparse import ArgumentParser
-from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Iterator
+from xed_db import XedSnapshot, parse_pattern_constraints
+from gen_sdm_urls import collect_sdm_dict, resolve_sdm_urls, sdm_fetch_timeout, sdm_fetch_retries
+from xed_profile import add_profile_argument, start_profile, finish_profile, profile_stage, profile_iter
 
 python_version = sys.version_info
 if not (python_version.major == 3 and python_version.minor >= 10):
     print('ERROR: this script requires Python 3.10 or above')
     sys.exit()
 
-def rm_adj_dups(xs : list[Any]) -> list[Any]:
-    ys, last = ([], None)
-    for x in xs:
-        if x != last:
-            ys.append(x)
-            last = x
-    return ys
+def rm_dups(xs : list[Any]) -> list[Any]:
+    return list(dict.fromkeys(xs))
+
+class Space(IntEnum):
+    LEGACY = 0
+    VEX = 1
+    EVEX = 2
+    XOP = 3
+
+class Mode(IntEnum):
+    MODE16 = 0
+    MODE32 = 1
+    MODE64 = 2
+    NOT64 = 3
+    ANY = 4
+
+class Mod(IntEnum):
+    NOT3 = -2
+    ANY = -1
+    MOD0 = 0
+    MOD1 = 1
+    MOD2 = 2
+    MOD3 = 3
+
+class Vl(IntEnum):
+    VL128 = 0
+    VL256 = 1
+    VL512 = 2
+    LIG = 3
+    NA = 4
+
+reg_rm_any = -1
+
+no_constraint = dict()
+
+mode_decoding = {
+    0: Mode.MODE16,
+    1: Mode.MODE32,
+    2: Mode.MODE64,
+    'not64': Mode.NOT64,
+    'unspecified': Mode.ANY,
+}
+
+vl_decoding = {
+    None: Vl.NA,
+    'n/a': Vl.NA,
+    '128': Vl.VL128,
+    '256': Vl.VL256,
+    '512': Vl.VL512,
+    'LIG': Vl.LIG,
+}
+
+vl_labels = {
+    Vl.VL128: '128',
+    Vl.VL256: '256',
+    Vl.VL512: '512',
+    Vl.LIG: 'LIG',
+}
+
+def decode_mod(mod: Any) -> Mod:
+    if mod == 'unspecified':
+        return Mod.ANY
+    if mod == '00/01/10':
+        return Mod.NOT3
+    return Mod(int(mod))
+
+def decode_reg_rm(val: Any) -> int:
+    if val == 'unspecified':
+        return reg_rm_any
+    return int(val)
+
+def decode_vl(vl: Any) -> Vl:
+    return vl_decoding[None if vl is None else str(vl)]
+
+Constraints = dict[str, dict[str, frozenset[str]]]
+
+def freeze_constraints(constraints: dict[str, dict[str, list[str]]]) -> Constraints:
+    return { field: { op: frozenset(vals) for (op, vals) in ops.items() } for (field, ops) in constraints.items() }
+
+@cache
+def load_constraints(constraints_json: str) -> Constraints:
+    return freeze_constraints(json.loads(constraints_json))
+
+@cache
+def parse_constraints(pattern: str) -> Constraints:
+    return freeze_constraints(parse_pattern_constraints(pattern))
+
+def decode_constraints(row: sqlite3.Row) -> Constraints:
+    if 'constraints' in row.keys():
+        return load_constraints(row['constraints'])
+    else:
+        return parse_constraints(row['pattern'])
+
+def split_operands(operands: str) -> tuple[str, ...]:
+    return tuple(operands.replace('none', '').lower().split())
+
+class InstRec:
+
+    __slots__ = ('iclass', 'space', 'map', 'opcode', 'opcode_hex', 'partial_opcode', 'pattern', 'constraints',
+                 'pp', 'mode', 'cpl', 'has_modrm', 'mod', 'reg', 'rm', 'vl', 'rexw_prefix', 'operands', 'explicit_operands',
+                 'implicit_operands', 'mnemonic', 'attributes', 'extension', 'isa_set', 'info')
+
+    def __init__(self, row: sqlite3.Row):
+        self.iclass = row['iclass']
+        self.space = Space[row['space'].upper()]
+        self.map = int(row['map'])
+        self.opcode = int(row['opcode_int'])
+        self.opcode_hex = row['opcode_hex']
+        self.partial_opcode = bool(row['partial_opcode'])
+        self.pattern = row['pattern']
+        self.constraints = decode_constraints(row)
+        self.pp = row['pp']
+        self.mode = mode_decoding[row['mode_restriction']]
+        self.cpl = int(row['cpl'])
+        self.has_modrm = bool(row['has_modrm'])
+        self.mod = decode_mod(row['mod_required'])
+        self.reg = decode_reg_rm(row['reg_required'])
+        self.rm = decode_reg_rm(row['rm_required'])
+        self.vl = decode_vl(row['vl'])
+        rexw_prefix = row['rexw_prefix']
+        self.rexw_prefix = None if rexw_prefix is None else str(rexw_prefix)
+        self.operands = tuple(row['operands'].lower().split())
+        self.explicit_operands = split_operands(row['explicit_operands'])
+        self.implicit_operands = split_operands(row['implicit_operands'])
+        mnemonic = row['disasm_intel']
+        if mnemonic is None:
+            mnemonic = row['disasm']
+        if mnemonic is None:
+            mnemonic = self.iclass
+        self.mnemonic = mnemonic.lower()
+        self.attributes = frozenset(row['attributes'].split())
+        self.extension = row['extension']
+        self.isa_set = row['isa_set']
+        self.info = None
+
+    def requires(self, field: str, op: str, val: str) -> bool:
+        return val in self.constraints.get(field, no_constraint).get(op, ())
+
+    def captures(self, field: str) -> bool:
+        return '[]' in self.constraints.get(field, no_constraint)
 
 Iclass = str
-InstDef = sqlite3.Row
+InstDef = InstRec
 IclassDefs = list[InstDef]
 OpcodeMapCell = dict[Iclass, IclassDefs]
 OneOpcodeMap = list[OpcodeMapCell]
@@ -85,8 +226,7 @@ The following color-coding scheme is used:
 </p>
 '''
 
-def html_final(maps_html: str, modals_click_js: str, modals_exit_js) -> str:
-    return f'''
+html_head = f'''
 <!DOCTYPE html>
 <html>
 <head>
@@ -186,48 +326,52 @@ x86 opcode map
 <button class="collapsible">Legend</button>
 <div class="content" style="{center_width} margin: auto; font-size: 20px">{legend_html}</div>
 
-{maps_html}
+'''
+
+html_script_head = '''
 
 <script>
 
 var coll = document.getElementsByClassName("collapsible");
 var i;
-for (i = 0; i < coll.length; i++) {{
-  coll[i].addEventListener("click", function() {{
+for (i = 0; i < coll.length; i++) {
+  coll[i].addEventListener("click", function() {
     this.classList.toggle("active");
     var content = this.nextElementSibling;
-    if (content.style.maxHeight){{
+    if (content.style.maxHeight){
       content.style.maxHeight = null;
-    }} else {{
+    } else {
       content.style.maxHeight = content.scrollHeight + "px";
-    }} 
-  }});
-}}
+    } 
+  });
+}
 
-{modals_click_js}
+'''
 
-window.onclick = function(event) {{
-  switch (event.target) {{
-    {modals_exit_js}
-  }}
-}}
+html_tail = '''
 
 </script>
 </body>
 </html>
 '''
 
-def html_modal_button(modal_id: str, iclass: str, color: str, url: str | None) -> str:
-    button = f'<div style="display: inline; color: {color}" id="modal_button_{modal_id}">{cell_indent}{iclass}</div>'
+html_modes = ['classic', 'delegated', 'lazy']
+
+def html_modal_button(modal_id: str, iclass: str, color: str, url: str | None, html_mode: str) -> str:
+    if html_mode == 'classic':
+        button = f'<div style="display: inline; color: {color}" id="modal_button_{modal_id}">{cell_indent}{iclass}</div>'
+    else:
+        button = f'<div style="display: inline; color: {color}" data-modal="{modal_id}">{cell_indent}{iclass}</div>'
     sdm_link = f' <sup><a href="{url}" target="_blank">*</a></sup>' if url else ''
     return button + sdm_link
 
-def html_modal_popup(modal_id: str, inst_strs: list[str]) -> str:
+def html_modal_popup(modal_id: str, inst_strs: list[str], html_mode: str) -> str:
     all_inst_strs = '\n    '.join(inst_strs)
+    close_id = f' id="modal_close_{modal_id}"' if html_mode == 'classic' else ''
     return f'''
 <div id="modal_popup_{modal_id}" class="modal">
   <div class="modal-content">
-    <span id="modal_close_{modal_id}" class="close">&times;</span>
+    <span{close_id} class="close">&times;</span>
     {all_inst_strs}
   </div>
 </div>
@@ -259,171 +403,245 @@ def js_modal_exit(modal_id: str) -> str:
       break;
 '''
 
+def iter_joined(sep: str, fragments: Iterable[str]) -> Iterator[str]:
+    for (idx, fragment) in enumerate(fragments):
+        if idx > 0:
+            yield sep
+        yield fragment
+
+def iter_js_classic_modals(modal_ids: list[str]) -> Iterator[str]:
+    yield from iter_joined('\n', ( js_modal_click(modal_id) for modal_id in modal_ids ))
+    yield '\n\nwindow.onclick = function(event) {\n  switch (event.target) {\n    '
+    yield from iter_joined('\n', ( js_modal_exit(modal_id) for modal_id in modal_ids ))
+    yield '\n  }\n}'
+
+js_delegated_modals = '''
+var open_modal = null;
+
+function close_modal() {
+  if (open_modal) {
+    open_modal.style.display = "none";
+    open_modal = null;
+  }
+}
+
+document.addEventListener("click", function(event) {
+  var button = event.target.closest("[data-modal]");
+  if (button) {
+    close_modal();
+    open_modal = document.getElementById("modal_popup_" + button.dataset.modal);
+    open_modal.style.display = "block";
+  } else if (event.target.classList.contains("close") || event.target.classList.contains("modal")) {
+    close_modal();
+  }
+});
+
+window.addEventListener("keydown", function(event) {
+  if (event.key === "Escape") {
+    close_modal();
+  }
+});
+'''
+
+js_lazy_modals = '''
+var modal_data = null;
+var modal_popup = document.getElementById("modal_popup");
+var modal_body = document.getElementById("modal_body");
+
+document.addEventListener("click", function(event) {
+  var button = event.target.closest("[data-modal]");
+  if (button) {
+    if (modal_data === null) {
+      modal_data = JSON.parse(document.getElementById("modal_data").textContent);
+    }
+    modal_body.innerHTML = modal_data[button.dataset.modal].join("\\n");
+    modal_popup.style.display = "block";
+  } else if (event.target.classList.contains("close") || event.target.classList.contains("modal")) {
+    modal_popup.style.display = "none";
+  }
+});
+
+window.addEventListener("keydown", function(event) {
+  if (event.key === "Escape") {
+    modal_popup.style.display = "none";
+  }
+});
+'''
+
+html_lazy_popup = '''
+
+<div id="modal_popup" class="modal">
+  <div class="modal-content">
+    <span class="close">&times;</span>
+    <div id="modal_body"></div>
+  </div>
+</div>
+
+'''
+
+def iter_popups_json(all_maps: AllOpcodeMaps, map_id: int) -> Iterator[str]:
+    for opcode in range(256):
+        for (_, iclass, inst_divs) in make_iclass_infos(all_maps, map_id, opcode):
+            modal_id = make_modal_id(map_id, opcode, iclass)
+            yield json.dumps(modal_id) + ':' + json.dumps(inst_divs, separators=(',', ':')).replace('</', '<\\/')
+
+def iter_html_lazy_popups(all_maps: AllOpcodeMaps, map_ids: list[int], pool: ProcessPoolExecutor | None) -> Iterator[str]:
+    yield html_lazy_popup
+    yield '<script type="application/json" id="modal_data">{'
+    if pool:
+        maps_popups_json = pool.map(render_worker_popups, map_ids)
+    else:
+        maps_popups_json = ( iter_popups_json(all_maps, map_id) for map_id in map_ids )
+    yield from iter_joined(',', itertools.chain.from_iterable(maps_popups_json))
+    yield '}</script>'
+
 def make_modal_id(map_id: int, opcode: int, iclass: str):
     return f'map_{map_id:02d}_opc_{opcode:02X}_{iclass}'
 
+mode_strs = {
+    Mode.NOT64: '!64b mode',
+    Mode.MODE16: '16b mode',
+    Mode.MODE32: '32b mode',
+    Mode.MODE64: '64b mode',
+    Mode.ANY: 'Any mode',
+}
+
 def make_mode_str(inst: InstDef) -> str:
-    mode = inst['mode_restriction']
-    if mode == 'not64':
-        return '!64b mode'
-    if mode == 0:
-        return '16b mode'
-    if mode == 1:
-        return '32b mode'
-    if mode == 2:
-        return '64b mode'
-    assert mode == 'unspecified'
-    return 'Any mode'
+    return mode_strs[inst.mode]
 
 def make_cpl_str(inst: InstDef) -> str:
-    cpl = inst['cpl']
-    if int(cpl) == 0:
+    if inst.cpl == 0:
         return ' CPL0'
     else:
         return ''
 
+def requires_size(inst: InstDef, field: str, val: str) -> bool:
+    return inst.requires(field, '=', val) or inst.requires(f'E{field}', '=', val)
+
 def make_legacy_prefix_str(inst: InstDef) -> str:
-    pattern = inst['pattern']
-    pfx = inst['pp'].split()
-    if 'LOCK=1' in pattern:
+    pfx = inst.pp.split()
+    if inst.requires('LOCK', '=', '1'):
         pfx.append('F0')
-    if 'LOCK=0' in pattern:
+    if inst.requires('LOCK', '=', '0'):
         pfx.append('!F0')
-    if 'ASZ=1' in pattern:
+    if requires_size(inst, 'ASZ', '1'):
         pfx.append('67')
-    if 'ASZ=0' in pattern:
+    if requires_size(inst, 'ASZ', '0'):
         pfx.append('!67')
-    if 'OSZ=1' in pattern and '66' not in pfx:
+    if requires_size(inst, 'OSZ', '1') and '66' not in pfx:
         pfx.append('66')
-    if 'OSZ=0' in pattern and 'NP' not in pfx:
+    if requires_size(inst, 'OSZ', '0') and 'NP' not in pfx:
         pfx.append('!66')
-    if 'REP=2' in pattern and 'F2' not in pfx:
+    if inst.requires('REP', '=', '2') and 'F2' not in pfx:
         pfx.append('F2')
-    if 'REP!=2' in pattern and 'NP' not in pfx:
+    if inst.requires('REP', '!=', '2') and 'NP' not in pfx:
         pfx.append('!F2')
-    if 'REP=3' in pattern and 'F3' not in pfx:
+    if inst.requires('REP', '=', '3') and 'F3' not in pfx:
         pfx.append('F3')
-    if 'REP!=3' in pattern and 'NP' not in pfx:
+    if inst.requires('REP', '!=', '3') and 'NP' not in pfx:
         pfx.append('!F3')
-    if 'REP=0' in pattern and 'NP' not in pfx:
+    if inst.requires('REP', '=', '0') and 'NP' not in pfx:
         pfx.append('!F2')
         pfx.append('!F3')
-    if ' REX2=1' in pattern:
+    if inst.requires('REX2', '=', '1'):
         pfx.append('REX2')
-    if ' NOREX2=1' in pattern:
+    if inst.requires('NOREX2', '=', '1'):
         pfx.append('!REX2')
-    if ' REXW=0' in pattern:
+    if inst.requires('REXW', '=', '0'):
         pfx.append('W0')
-    if ' REXW=1' in pattern:
+    if inst.requires('REXW', '=', '1'):
         pfx.append('W1')
     if pfx == []:
         return ''
     else:
         return '-'.join(pfx) + ': '
 
-re_nd_eq = re.compile(r'ND=(?P<val>0|1)')
-re_nf_eq = re.compile(r'NF=(?P<val>0|1)')
+def make_bit_suffix(inst: InstDef, field: str) -> str:
+    for val in ['0', '1']:
+        if inst.requires(field, '=', val):
+            return f'-{field}{val}'
+    return ''
 
 def make_vex_evex_prefix_str(inst: InstDef) -> str:
-    space = inst['space'].upper()
-    map = int(inst['map'])
-    pp = inst['pp']
-    vl = inst['vl']
-    pattern = inst['pattern']
-    if vl is None or vl == 'n/a' or map == 4:
+    space = inst.space.name
+    map = inst.map
+    pp = inst.pp
+    if inst.vl == Vl.NA or map == 4:
         vlen = ''
     else:
-        vlen = f'-{vl}'
-    rexw_prefix = inst['rexw_prefix']
+        vlen = f'-{vl_labels[inst.vl]}'
+    rexw_prefix = inst.rexw_prefix
     if rexw_prefix is None:
         rexw = ''
     elif rexw_prefix == 'unspecified':
         rexw = '-WIG'
     else:
         rexw = f'-W{rexw_prefix}'
-    m = re_nd_eq.search(pattern)
-    if m:
-        val = m.group('val')
-        nd_val = f'-ND{val}'
-    else:
-        nd_val = ''
-    m = re_nf_eq.search(pattern)
-    if m:
-        val = m.group('val')
-        nf_val = f'-NF{val}'
-    else:
-        nf_val = ''
-
+    nd_val = make_bit_suffix(inst, 'ND')
+    nf_val = make_bit_suffix(inst, 'NF')
     return f'{space}-MAP{map}-{pp}{vlen}{rexw}{nd_val}{nf_val}: '
 
 def make_prefix_str(inst: InstDef) -> str:
-    if inst['space'] == 'legacy':
+    if inst.space == Space.LEGACY:
         return make_legacy_prefix_str(inst)
     else:
         return make_vex_evex_prefix_str(inst)
 
 def make_modrm_str(inst: InstDef) -> str:
-    mod_required = inst['mod_required']
-    reg_required = inst['reg_required']
-    rm_required = inst['rm_required']
-    if mod_required in ['unspecified']:
-        assert reg_required == 'unspecified'
+    mod_required = inst.mod
+    reg_required = inst.reg
+    rm_required = inst.rm
+    if mod_required == Mod.ANY:
+        assert reg_required == reg_rm_any
         return '/r'
-    elif mod_required == '00/01/10':
-        if reg_required == 'unspecified':
+    elif mod_required == Mod.NOT3:
+        if reg_required == reg_rm_any:
             return '/r'
         else:
-            assert int(reg_required) in range(8)
+            assert reg_required in range(8)
             return f'/{reg_required}'
     else:
-        assert mod_required == 3
-        if reg_required == 'unspecified':
-            if rm_required == 'unspecified':
+        assert mod_required == Mod.MOD3
+        if reg_required == reg_rm_any:
+            if rm_required == reg_rm_any:
                 return '/r'
             else:
-                assert int(rm_required) in range(8)
+                assert rm_required in range(8)
                 return f'11:rrr:{rm_required}'
         else:
-            assert int(reg_required) in range(8)
-            if rm_required == 'unspecified':
+            assert reg_required in range(8)
+            if rm_required == reg_rm_any:
                 return f'/{reg_required}'
             else:
-                assert int(rm_required) in range(8)
+                assert rm_required in range(8)
                 modrm = (mod_required << 6) + (reg_required << 3) + rm_required
                 return f'{modrm:02X}'
 
+legacy_opcode_escapes = {
+    1: '0F ',
+    2: '0F 38 ',
+    3: '0F 3A ',
+    4: '0F 0F ',
+}
+
 def make_opcode_str(inst: InstDef) -> str:
-    iclass = inst['iclass']
-    space = inst['space'].upper()
-    map = int(inst['map'])
     opcode_esc = ''
-    if space == 'LEGACY':
-        if map == 1:
-            opcode_esc = '0F '
-        elif map == 2:
-            opcode_esc = '0F 38 '
-        elif map == 3:
-            opcode_esc = '0F 3A '
-        elif map == 4:
-            opcode_esc = '0F 0F '
-    opcode_hex = inst['opcode_hex']
-    pattern = inst['pattern']
-    partial_opcode = inst['partial_opcode']
+    if inst.space == Space.LEGACY:
+        opcode_esc = legacy_opcode_escapes.get(inst.map, '')
     opcode_ext = ''
-    if 'MOD[' in pattern:
+    if inst.captures('MOD'):
         modrm = make_modrm_str(inst)
         opcode_ext = f' {modrm}'
-    elif partial_opcode == 1 and iclass not in ['NOP', 'PAUSE']:
+    elif inst.partial_opcode and inst.iclass not in ['NOP', 'PAUSE']:
         opcode_ext = '+r'
-    return f'{opcode_esc}{opcode_hex}{opcode_ext}'
+    return f'{opcode_esc}{inst.opcode_hex}{opcode_ext}'
 
 def make_operands_list(inst: InstDef) -> list[str]:
-    operands = inst['operands'].lower().split()
-    exp_opnds = inst['explicit_operands'].replace('none', '').lower().split()
-    imp_opnds = inst['implicit_operands'].replace('none', '').lower().split()
+    exp_opnds = inst.explicit_operands
+    imp_opnds = inst.implicit_operands
     opnds_list = []
     exp_idx, imp_idx = (0, 0)
-    for opnd in operands:
+    for opnd in inst.operands:
         if ':impl' in opnd or ':supp' in opnd:
             if imp_idx < len(imp_opnds):
                 opnds_list.append('&lt;' + imp_opnds[imp_idx] + '&gt;')
@@ -432,26 +650,19 @@ def make_operands_list(inst: InstDef) -> list[str]:
             if exp_idx < len(exp_opnds):
                 opnds_list.append(exp_opnds[exp_idx])
                 exp_idx += 1
-    assert exp_idx == len(exp_opnds) and imp_idx == len(imp_opnds), dict(inst)
+    assert exp_idx == len(exp_opnds) and imp_idx == len(imp_opnds), (inst.iclass, inst.pattern)
     return opnds_list
 
 def make_disasm_str(inst: InstDef) -> str:
-    mnemonic = inst['disasm_intel']
-    if mnemonic is None:
-        mnemonic = inst['disasm']
-    if mnemonic is None:
-        mnemonic = inst['iclass']
-    mnemonic = mnemonic.lower()
     operands = ', '.join(make_operands_list(inst))
-    return f'{mnemonic} {operands}'
+    return f'{inst.mnemonic} {operands}'
 
 def get_inst_family(inst: InstDef) -> str:
-    attributes = inst['attributes'].split()
-    extension = inst['extension']
-    isa_set = inst['isa_set']
+    extension = inst.extension
+    isa_set = inst.isa_set
     if any([ (name in isa_set) for name in ['PREFETCHWT1', 'AVX512ER', 'AVX512PF', 'AVX512_4FMAPS', 'AVX512_4VNNIW'] ]):
         return f'XEON_PHI_{isa_set}'
-    if 'AMDONLY' in attributes:
+    if 'AMDONLY' in inst.attributes:
         if 'AMD' in extension:
             return extension
         else:
@@ -461,7 +672,7 @@ def get_inst_family(inst: InstDef) -> str:
     else:
         return 'X86'
 
-def make_inst_info(inst: InstDef) -> tuple[str, str]:
+def render_inst_info(inst: InstDef) -> tuple[str, str]:
     mode_str = make_mode_str(inst)
     cpl_str = make_cpl_str(inst)
     prefix_str = make_prefix_str(inst)
@@ -476,6 +687,11 @@ def make_inst_info(inst: InstDef) -> tuple[str, str]:
     return (color,
             f'<div style="color: {color}">{mode_str}{cpl_str} | {prefix_str}{opcode_str} | {disasm_str}{family_str}</div>')
 
+def make_inst_info(inst: InstDef) -> tuple[str, str]:
+    if inst.info is None:
+        inst.info = render_inst_info(inst)
+    return inst.info
+
 prefix_opcode_dict = {
     0x66: 'OSIZE:', 0x67: 'ASIZE:',
     0xF0: 'LOCK:', 0xF2: 'REPNE:', 0xF3: 'REPE:',
@@ -498,34 +714,49 @@ def get_map0_special(map_id: int, opcode: int) -> list[str]:
     return []
 
 def inst_sort_key(inst: InstDef):
-    space = inst['space']
-    space_key = 0 if space == 'legacy' else 1 if space == 'vex' else 2
-    return (space_key, inst['vl'], inst['pattern'])
+    space_key = min(inst.space, Space.EVEX)
+    return (space_key, inst.vl, inst.pattern)
 
 def iclass_sort_key(info):
-    color, iclass, _ = info
+    color, iclass = info[:2]
     color_key = 0 if color == color_x86 else 1
     return (color_key, iclass)
 
-def html_cell(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, opcode: int) -> str:
-    opcode_hex = f'{opcode:02X}'
-    iclasses = all_maps[map_id][opcode].keys()
-    cell_info = []
-    for iclass in iclasses:
-        modal_id = make_modal_id(map_id, opcode, iclass)
-        iclass_url = sdm_urls.get(iclass, None)
-        inst_defs = sorted(all_maps[map_id][opcode][iclass], key=inst_sort_key)
+IclassInfo = tuple[str, Iclass, list[str]]
+
+def make_iclass_infos(all_maps: AllOpcodeMaps, map_id: int, opcode: int) -> list[IclassInfo]:
+    iclass_infos = []
+    for (iclass, iclass_defs) in all_maps[map_id][opcode].items():
+        inst_defs = sorted(iclass_defs, key=inst_sort_key)
         inst_colors, inst_divs = zip(*[ make_inst_info(inst) for inst in inst_defs ])
-        iclass_color = merge_colors(inst_colors)
-        modal_button = html_modal_button(modal_id, iclass, iclass_color, iclass_url)
-        modal_popup = html_modal_popup(modal_id, rm_adj_dups(inst_divs))
-        cell_info.append( (iclass_color, iclass, '\n'.join([modal_button, modal_popup])) )
-    if len(cell_info) > 0:
-        cell_info = sorted(cell_info, key=iclass_sort_key)
-        _, _, cell_contents = zip(*cell_info)
-        cell_contents = list(cell_contents)
+        iclass_infos.append( (merge_colors(inst_colors), iclass, rm_dups(inst_divs)) )
+    return sorted(iclass_infos, key=iclass_sort_key)
+
+def make_inst_color(inst: InstDef) -> str:
+    if inst.info is None:
+        return get_family_color(get_inst_family(inst))
+    return inst.info[0]
+
+def make_iclass_colors(all_maps: AllOpcodeMaps, map_id: int, opcode: int) -> list[tuple[str, Iclass]]:
+    iclass_colors = []
+    for (iclass, iclass_defs) in all_maps[map_id][opcode].items():
+        inst_defs = sorted(iclass_defs, key=inst_sort_key)
+        iclass_colors.append( (merge_colors([ make_inst_color(inst) for inst in inst_defs ]), iclass) )
+    return sorted(iclass_colors, key=iclass_sort_key)
+
+def html_cell(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, opcode: int, html_mode: str) -> str:
+    opcode_hex = f'{opcode:02X}'
+    cell_contents = []
+    if html_mode == 'lazy':
+        for (iclass_color, iclass) in make_iclass_colors(all_maps, map_id, opcode):
+            modal_id = make_modal_id(map_id, opcode, iclass)
+            cell_contents.append(html_modal_button(modal_id, iclass, iclass_color, sdm_urls.get(iclass, None), html_mode))
     else:
-        cell_contents = []
+        for (iclass_color, iclass, inst_divs) in make_iclass_infos(all_maps, map_id, opcode):
+            modal_id = make_modal_id(map_id, opcode, iclass)
+            modal_button = html_modal_button(modal_id, iclass, iclass_color, sdm_urls.get(iclass, None), html_mode)
+            modal_popup = html_modal_popup(modal_id, inst_divs, html_mode)
+            cell_contents.append('\n'.join([modal_button, modal_popup]))
     map0_special = get_map0_special(map_id, opcode)
     cell_contents_html = '<br>\n'.join(cell_contents + map0_special)
     return f'''
@@ -535,103 +766,346 @@ def html_cell(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, opcode: i
 </td>
 '''
 
-def html_row(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, row_id: int) -> str:
-    all_cols_html = '\n'.join([ html_cell(sdm_urls, all_maps, map_id, 16 * row_id + col_id) for col_id in range(16) ])
+def html_row(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, row_id: int, html_mode: str) -> str:
+    all_cols_html = '\n'.join([ html_cell(sdm_urls, all_maps, map_id, 16 * row_id + col_id, html_mode) for col_id in range(16) ])
     return f'''
 <tr>
 {all_cols_html}
 </tr>
 '''
 
-def html_one_map(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int) -> str:
-    all_rows_html = '\n'.join([ html_row(sdm_urls, all_maps, map_id, row_id) for row_id in range(16) ])
+def map_title(map_id: int) -> str:
     amd_xop = 'AMD XOP ' if map_id >= 8 else ''
-    return f'''
-<button class="collapsible">{amd_xop}Map {map_id}</button>
+    return f'{amd_xop}Map {map_id}'
+
+def iter_html_one_map(map_id: int, rows_html: Iterable[str]) -> Iterator[str]:
+    yield f'''
+<button class="collapsible">{map_title(map_id)}</button>
 <div class="content">
 <br>
 <table style="width:100%">
-{all_rows_html}
+'''
+    yield from iter_joined('\n', rows_html)
+    yield '''
 </table>
 <br>
 </div>
 '''
 
-def collect_maps_info(all_maps: AllOpcodeMaps) -> tuple[list[bool], list[str]]:
+def html_one_map(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, html_mode: str) -> str:
+    rows_html = ( html_row(sdm_urls, all_maps, map_id, row_id, html_mode) for row_id in range(16) )
+    return ''.join(iter_html_one_map(map_id, rows_html))
+
+def collect_empty_maps(all_maps: AllOpcodeMaps) -> list[bool]:
     empty_maps = [ True for map_id in range(max_num_maps) ]
-    modal_ids = []
     for map_id in range(max_num_maps):
         for opcode in range(256):
             for iclass in all_maps[map_id][opcode]:
                 iclass_size = len(all_maps[map_id][opcode][iclass])
                 assert iclass_size > 0
                 empty_maps[map_id] = False
-                modal_ids.append(make_modal_id(map_id, opcode, iclass))
-    return (empty_maps, modal_ids)
-
-def html_all_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps) -> str:
-    empty_maps, modal_ids = collect_maps_info(all_maps)
-    maps_html = '\n'.join([ html_one_map(sdm_urls, all_maps, map_id)
-                            for map_id in range(max_num_maps) if not empty_maps[map_id] ])
-    modals_click_js = '\n'.join([ js_modal_click(modal_id) for modal_id in modal_ids ])
-    modals_exit_js = '\n'.join([ js_modal_exit(modal_id) for modal_id in modal_ids ])
-    return html_final(maps_html, modals_click_js, modals_exit_js)
-
-def collect_all_maps(db: sqlite3.Cursor) -> AllOpcodeMaps:
-    all_maps = [ [ dict([]) for opcode in range(256) ] for map_id in range(max_num_maps) ]
-    for inst in db:
-        map_id = inst['map']
-        opcode = inst['opcode_int']
-        iclass = inst['iclass']
-        pattern = inst['pattern']
-        if inst['partial_opcode']:
-            for i in range(8):
-                if iclass == 'PAUSE' and i > 0:
-                    break
-                if iclass == 'NOP' and (i > 0 or 'P4=0' in pattern):
-                    break
-                if iclass == 'XCHG' and opcode == 0x90 and i > 0 and 'SRM=0' in pattern:
-                    break
-                if iclass == 'XCHG' and opcode == 0x90 and i == 0:
-                    continue
-                iclass_defs = all_maps[map_id][opcode + i].get(iclass, [])
-                iclass_defs.append(inst)
-                all_maps[map_id][opcode + i][iclass] = iclass_defs
+    return empty_maps
+
+def collect_modal_ids(all_maps: AllOpcodeMaps, map_ids: list[int]) -> list[str]:
+    return [ make_modal_id(map_id, opcode, iclass) for map_id in map_ids for opcode in range(256) for iclass in all_maps[map_id][opcode] ]
+
+def nonempty_map_ids(all_maps: AllOpcodeMaps) -> list[int]:
+    empty_maps = collect_empty_maps(all_maps)
+    return [ map_id for map_id in range(max_num_maps) if not empty_maps[map_id] ]
+
+render_worker_args = None
+
+def init_render_worker(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, html_mode: str) -> None:
+    global render_worker_args
+    render_worker_args = (sdm_urls, all_maps, html_mode)
+
+def render_worker_row(task: tuple[int, int]) -> str:
+    (sdm_urls, all_maps, html_mode) = render_worker_args
+    (map_id, row_id) = task
+    return html_row(sdm_urls, all_maps, map_id, row_id, html_mode)
+
+def render_worker_popups(map_id: int) -> list[str]:
+    (_, all_maps, _) = render_worker_args
+    return list(iter_popups_json(all_maps, map_id))
+
+def render_worker_shard(task: tuple[int, str]) -> str:
+    (sdm_urls, all_maps, html_mode) = render_worker_args
+    (map_id, shard_format) = task
+    return render_shard(sdm_urls, all_maps, map_id, shard_format, html_mode)
+
+def make_render_pool(jobs: int, sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, html_mode: str) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_render_worker, initargs=(sdm_urls, all_maps, html_mode))
+
+def iter_html_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_ids: list[int], html_mode: str,
+                   pool: ProcessPoolExecutor | None = None) -> Iterator[str]:
+    yield html_head
+    if pool:
+        all_rows_html = pool.map(render_worker_row, [ (map_id, row_id) for map_id in map_ids for row_id in range(16) ], chunksize=4)
+    for (idx, map_id) in enumerate(map_ids):
+        if idx > 0:
+            yield '\n'
+        if pool:
+            rows_html = itertools.islice(all_rows_html, 16)
         else:
-            iclass_defs = all_maps[map_id][opcode].get(iclass, [])
+            rows_html = ( html_row(sdm_urls, all_maps, map_id, row_id, html_mode) for row_id in range(16) )
+        yield from iter_html_one_map(map_id, rows_html)
+    if html_mode == 'lazy':
+        yield from iter_html_lazy_popups(all_maps, map_ids, pool)
+    yield html_script_head
+    if html_mode == 'classic':
+        yield from iter_js_classic_modals(collect_modal_ids(all_maps, map_ids))
+    elif html_mode == 'delegated':
+        yield js_delegated_modals
+    else:
+        yield js_lazy_modals
+    yield html_tail
+
+def iter_html_all_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, html_mode: str = 'classic',
+                       pool: ProcessPoolExecutor | None = None) -> Iterator[str]:
+    yield from iter_html_maps(sdm_urls, all_maps, nonempty_map_ids(all_maps), html_mode, pool)
+
+def html_all_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, html_mode: str = 'classic',
+                  pool: ProcessPoolExecutor | None = None) -> str:
+    return ''.join(iter_html_all_maps(sdm_urls, all_maps, html_mode, pool))
+
+shard_formats = ['html', 'json']
+
+def shard_name(map_id: int, shard_format: str) -> str:
+    return f'map_{map_id:02d}.{shard_format}'
+
+def map_json(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int) -> dict[str, Any]:
+    cells = dict()
+    for opcode in range(256):
+        iclass_infos = make_iclass_infos(all_maps, map_id, opcode)
+        if iclass_infos:
+            cells[f'{opcode:02X}'] = [ {'iclass': iclass, 'color': color, 'url': sdm_urls.get(iclass, None), 'forms': inst_divs}
+                                       for (color, iclass, inst_divs) in iclass_infos ]
+    return {'map': map_id, 'title': map_title(map_id), 'cells': cells}
+
+def render_shard(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, map_id: int, shard_format: str, html_mode: str) -> str:
+    if shard_format == 'html':
+        return ''.join(iter_html_maps(sdm_urls, all_maps, [map_id], html_mode))
+    else:
+        return json.dumps(map_json(sdm_urls, all_maps, map_id), indent=1)
+
+def render_shard_index(map_ids: list[int], shard_format: str) -> tuple[str, str]:
+    if shard_format == 'json':
+        index = { 'maps': [ {'map': map_id, 'title': map_title(map_id), 'file': shard_name(map_id, shard_format)}
+                            for map_id in map_ids ] }
+        return ('index.json', json.dumps(index, indent=1))
+    links = '\n'.join([ f'<li><a href="{shard_name(map_id, shard_format)}">{map_title(map_id)}</a></li>' for map_id in map_ids ])
+    return ('index.html', f'''<!DOCTYPE html>
+<html>
+<head>
+<meta name="viewport" content="width=device-width, Initial-scale=1">
+</head>
+<body>
+<h1 style="text-align: center">
+x86 opcode map
+</h1>
+<ul style="{center_width} margin: auto; font-size: 24px">
+{links}
+</ul>
+</body>
+</html>
+''')
+
+def output_shards(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, out_dir: str, shard_format: str, html_mode: str,
+                  pool: ProcessPoolExecutor | None = None) -> None:
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_path / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as manifest_fp:
+            old_manifest = json.load(manifest_fp)
+    else:
+        old_manifest = dict()
+    map_ids = nonempty_map_ids(all_maps)
+    if pool:
+        shards_contents = pool.map(render_worker_shard, [ (map_id, shard_format) for map_id in map_ids ])
+    else:
+        shards_contents = ( render_shard(sdm_urls, all_maps, map_id, shard_format, html_mode) for map_id in map_ids )
+    shards = [ (shard_name(map_id, shard_format), contents) for (map_id, contents) in zip(map_ids, shards_contents) ]
+    shards.append(render_shard_index(map_ids, shard_format))
+    new_manifest = dict()
+    for (name, contents) in shards:
+        digest = hashlib.sha256(contents.encode()).hexdigest()
+        new_manifest[name] = digest
+        if old_manifest.get(name, None) != digest or not (out_path / name).exists():
+            with open(out_path / name, 'w') as shard_fp:
+                shard_fp.write(contents)
+            print(f'[INFO] updated {name}')
+    for name in old_manifest:
+        if name not in new_manifest:
+            (out_path / name).unlink(missing_ok=True)
+            print(f'[INFO] removed {name}')
+    if new_manifest != old_manifest:
+        with open(manifest_path, 'w') as manifest_fp:
+            json.dump(new_manifest, manifest_fp, indent=4, sort_keys=True)
+
+def add_inst(all_maps: AllOpcodeMaps, inst: InstDef) -> None:
+    map_id = inst.map
+    opcode = inst.opcode
+    iclass = inst.iclass
+    if inst.partial_opcode:
+        for i in range(8):
+            if iclass == 'PAUSE' and i > 0:
+                break
+            if iclass == 'NOP' and (i > 0 or inst.requires('P4', '=', '0')):
+                break
+            if iclass == 'XCHG' and opcode == 0x90 and i > 0 and inst.requires('SRM', '=', '0'):
+                break
+            if iclass == 'XCHG' and opcode == 0x90 and i == 0:
+                continue
+            iclass_defs = all_maps[map_id][opcode + i].get(iclass, [])
             iclass_defs.append(inst)
-            all_maps[map_id][opcode][iclass] = iclass_defs
+            all_maps[map_id][opcode + i][iclass] = iclass_defs
+    else:
+        iclass_defs = all_maps[map_id][opcode].get(iclass, [])
+        iclass_defs.append(inst)
+        all_maps[map_id][opcode][iclass] = iclass_defs
+
+def make_empty_maps() -> AllOpcodeMaps:
+    return [ [ dict([]) for opcode in range(256) ] for map_id in range(max_num_maps) ]
+
+def collect_all_maps(db: Iterable[sqlite3.Row]) -> AllOpcodeMaps:
+    all_maps = make_empty_maps()
+    for row in db:
+        add_inst(all_maps, InstRec(row))
     return all_maps
 
 def input_sdm_urls(sdm_urls_json) -> SdmUrls:
     with open(sdm_urls_json, 'r') as sdm_urls_json_fp:
         return json.load(sdm_urls_json_fp)
 
-def input_sqlite_db(db_file: str) -> sqlite3.Cursor:
-    with sqlite3.connect(db_file) as db:
-        db.row_factory = InstDef
-        sql_query = 'SELECT DISTINCT * from Instructions order by map, opcode_int, iclass;'
-        insts = db.execute(sql_query)
-        return insts
+sqlite_mmap_size = 1 << 28
+sqlite_fetch_size = 10000
 
-def output_all_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, out_file: str) -> None:
-    with open(out_file, 'w') as out_fp:
-        out_fp.write(html_all_maps(sdm_urls, all_maps))
+def open_sqlite_db(db_file: str, immutable: bool = False, mmap_size: int = sqlite_mmap_size,
+                   check_same_thread: bool = True) -> sqlite3.Connection:
+    if immutable:
+        db_uri = Path(db_file).resolve().as_uri() + '?mode=ro&immutable=1'
+        db = sqlite3.connect(db_uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        db = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+    db.row_factory = sqlite3.Row
+    db.execute(f'PRAGMA mmap_size = {mmap_size};')
+    return db
+
+def fetch_rows(db: sqlite3.Connection, sql_query: str, sql_args: Iterable[Any] = (),
+               fetch_size: int = sqlite_fetch_size) -> Iterator[sqlite3.Row]:
+    cursor = db.execute(sql_query, sql_args)
+    while rows := cursor.fetchmany(fetch_size):
+        yield from rows
+
+inst_columns = [
+    'map', 'opcode_int', 'iclass', 'space', 'opcode_hex', 'partial_opcode', 'pattern', 'constraints', 'pp',
+    'mode_restriction', 'cpl', 'has_modrm', 'mod_required', 'reg_required', 'rm_required', 'vl', 'rexw_prefix',
+    'operands', 'explicit_operands', 'implicit_operands', 'disasm_intel', 'disasm', 'attributes', 'extension', 'isa_set',
+]
+
+distinct_query = 'SELECT DISTINCT * from Instructions order by map, opcode_int, iclass;'
+
+def grouped_query(db: sqlite3.Connection) -> str:
+    table_columns = [ col['name'] for col in db.execute('PRAGMA table_info(Instructions);') ]
+    columns = ','.join([ col for col in inst_columns if col in table_columns ])
+    return f'SELECT DISTINCT {columns} from Instructions ORDER BY {columns};'
+
+def input_sqlite_db(db_file: str, grouped: bool = False, immutable: bool = False,
+                    mmap_size: int = sqlite_mmap_size, fetch_size: int = sqlite_fetch_size) -> Iterator[sqlite3.Row]:
+    with closing(open_sqlite_db(db_file, immutable, mmap_size)) as db:
+        sql_query = grouped_query(db) if grouped else distinct_query
+        yield from fetch_rows(db, sql_query, (), fetch_size)
+
+def input_snapshot(snapshot_file: str) -> Iterator[dict[str, Any]]:
+    with XedSnapshot(snapshot_file) as snapshot:
+        inst_attrs = snapshot.inst_attrs
+        key_idxs = [ inst_attrs.index(attr) for attr in ['map', 'opcode_int', 'iclass'] ]
+        value = snapshot.value
+        rows = [ tuple([ value(val_id) for val_id in row_ids ]) for row_ids in dict.fromkeys(zip(*snapshot.columns)) ]
+    rows.sort(key=lambda row: tuple([ row[idx] for idx in key_idxs ]))
+    for row in rows:
+        yield dict(zip(inst_attrs, row))
+
+def output_all_maps(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, out_file: str, html_mode: str = 'classic',
+                    pool: ProcessPoolExecutor | None = None) -> None:
+    html = profile_iter('render html', iter_html_all_maps(sdm_urls, all_maps, html_mode, pool))
+    if out_file == '-':
+        sys.stdout.writelines(html)
+    else:
+        with open(out_file, 'w') as out_fp:
+            out_fp.writelines(html)
+
+def refresh_sdm_urls(sdm_urls: SdmUrls, all_maps: AllOpcodeMaps, sdm_index: str, cache_dir: str | None,
+                     timeout: float = sdm_fetch_timeout, retries: int = sdm_fetch_retries,
+                     max_age: float | None = None) -> SdmUrls:
+    iclasses = sorted(set([ iclass for one_map in all_maps for cell in one_map for iclass in cell ]))
+    sdm_dict = collect_sdm_dict(sdm_index, cache_dir, timeout, retries, max_age)
+    (iclass_urls, missing) = resolve_sdm_urls(iclasses, sdm_dict)
+    print(f'[INFO] resolved {len(iclass_urls)} iclasses against {sdm_index}; {len(missing)} unresolved', file=sys.stderr)
+    return { **sdm_urls, **iclass_urls }
 
 this_dir = Path(__file__).resolve().parent
 default_sdm_urls_json = str(this_dir / 'sdm_urls.json')
 
 def main() -> None:
     parser = ArgumentParser(description='Make HTML opcopde map from SQLite database extracted from a XED build')
-    parser.add_argument('xed_sqlite', type=str, help='input SQLite database extracted from a XED build')
-    parser.add_argument('opcmap_html', type=str, help='output HTML opcode map')
+    parser.add_argument('xed_sqlite', type=str, help='input SQLite database (or .snap snapshot) extracted from a XED build')
+    parser.add_argument('opcmap_html', type=str,
+                        help='output HTML opcode map (- for the standard output), or the output directory with --shard-format')
     parser.add_argument('--sdm-urls-json', default=default_sdm_urls_json,
                         help=f'input JSON file containing SDM instruction reference URLs (default: {default_sdm_urls_json})')
+    parser.add_argument('--html-mode', choices=html_modes, default='classic',
+                        help=('classic: a click handler per popup; delegated: one click/keydown handler for all popups; '
+                              'lazy: like delegated, but popups are built on demand from embedded JSON (default: classic)'))
+    parser.add_argument('--shard-format', choices=shard_formats,
+                        help='write one file per map plus an index, rewriting only the files whose contents changed')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes rendering the maps (default: 1)')
+    parser.add_argument('--grouped', action='store_true',
+                        help='select only the columns used by the opcode map instead of SELECT DISTINCT *')
+    parser.add_argument('--immutable', action='store_true',
+                        help='open the SQLite database read-only as an immutable file, i.e., without any locking')
+    parser.add_argument('--mmap-size', type=int, default=sqlite_mmap_size,
+                        help=f'bytes of the SQLite database accessed by memory-mapped I/O (default: {sqlite_mmap_size})')
+    parser.add_argument('--fetch-size', type=int, default=sqlite_fetch_size,
+                        help=f'number of rows fetched from the SQLite database at a time (default: {sqlite_fetch_size})')
+    parser.add_argument('--sdm-index', type=str,
+                        help='resolve the SDM URLs of all iclasses against this SDM index (URL, .html, .json, or directory; see gen_sdm_urls.py)')
+    parser.add_argument('--sdm-cache-dir', type=str, help='directory caching the SDM index fetched for --sdm-index')
+    parser.add_argument('--sdm-max-age', type=float,
+                        help='seconds for which the SDM index cached in --sdm-cache-dir is used without any request')
+    parser.add_argument('--sdm-timeout', type=float, default=sdm_fetch_timeout,
+                        help=f'timeout in seconds of fetching the SDM index for --sdm-index (default: {sdm_fetch_timeout})')
+    parser.add_argument('--sdm-retries', type=int, default=sdm_fetch_retries,
+                        help=f'number of retries of fetching the SDM index for --sdm-index (default: {sdm_fetch_retries})')
+    add_profile_argument(parser)
     args = parser.parse_args()
-    sdm_urls = input_sdm_urls(args.sdm_urls_json)
-    xed_db = input_sqlite_db(args.xed_sqlite)
-    all_maps = collect_all_maps(xed_db)
-    output_all_maps(sdm_urls, all_maps, args.opcmap_html)
+    start_profile(args.profile)
+    with profile_stage('input sdm urls'):
+        sdm_urls = input_sdm_urls(args.sdm_urls_json)
+    if Path(args.xed_sqlite).suffix == '.snap':
+        xed_db = profile_iter('snapshot read', input_snapshot(args.xed_sqlite))
+    else:
+        xed_db = profile_iter('sql query', input_sqlite_db(args.xed_sqlite, args.grouped, args.immutable,
+                                                           args.mmap_size, args.fetch_size))
+    with profile_stage('collect maps'):
+        all_maps = collect_all_maps(xed_db)
+    if args.sdm_index:
+        with profile_stage('resolve sdm urls'):
+            sdm_urls = refresh_sdm_urls(sdm_urls, all_maps, args.sdm_index, args.sdm_cache_dir,
+                                        args.sdm_timeout, args.sdm_retries, args.sdm_max_age)
+    pool = make_render_pool(args.jobs, sdm_urls, all_maps, args.html_mode) if args.jobs > 1 else None
+    try:
+        if args.shard_format:
+            with profile_stage('output shards'):
+                output_shards(sdm_urls, all_maps, args.opcmap_html, args.shard_format, args.html_mode, pool)
+        else:
+            with profile_stage('output html'):
+                output_all_maps(sdm_urls, all_maps, args.opcmap_html, args.html_mode, pool)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    finish_profile()
 
 if __name__ == '__main__':
     main()
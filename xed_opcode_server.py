@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import json
+import html
+import queue
+import sqlite3
+from functools import lru_cache
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from argparse import ArgumentParser
+from typing import Any, Iterator
+from xed_opcode_map import (AllOpcodeMaps, SdmUrls, collect_all_maps, fetch_rows, make_iclass_infos,
+                            open_sqlite_db, input_sdm_urls, default_sdm_urls_json, max_num_maps,
+                            sqlite_mmap_size)
+
+Query = tuple[tuple[str, str], ...]
+
+query_columns = {
+    'iclass': 'iclass',
+    'space': 'space',
+    'isa_set': 'isa_set',
+    'extension': 'extension',
+    'category': 'category',
+}
+
+query_formats = ['json', 'html']
+
+def parse_int(s: str) -> int:
+    return int(s, 16) if s.lower().startswith('0x') else int(s)
+
+def parse_query(params: dict[str, list[str]]) -> tuple[Query, str]:
+    fmt = params.pop('format', ['json'])[-1]
+    if fmt not in query_formats:
+        raise ValueError(f'unknown format: {fmt}')
+    query = []
+    for (key, vals) in sorted(params.items()):
+        val = vals[-1]
+        if key == 'map':
+            if not 0 <= parse_int(val) < max_num_maps:
+                raise ValueError(f'map out of range: {val}')
+        elif key == 'opcode':
+            if not 0 <= int(val, 16) < 256:
+                raise ValueError(f'opcode out of range: {val}')
+        elif key not in query_columns:
+            raise ValueError(f'unknown query parameter: {key}')
+        query.append( (key, val) )
+    if not query:
+        raise ValueError('empty query')
+    return (tuple(query), fmt)
+
+def make_sql_query(query: Query) -> tuple[str, list[Any]]:
+    conds = []
+    sql_args = []
+    for (key, val) in query:
+        if key == 'map':
+            conds.append('map = ?')
+            sql_args.append(parse_int(val))
+        elif key == 'opcode':
+            opcode = int(val, 16)
+            conds.append('opcode_int BETWEEN ? AND ?')
+            sql_args.extend([max(opcode - 7, 0), opcode])
+        else:
+            conds.append(f'{query_columns[key]} GLOB ?')
+            sql_args.append(val)
+    sql_query = f'SELECT DISTINCT * from Instructions WHERE {" AND ".join(conds)} order by map, opcode_int, iclass;'
+    return (sql_query, sql_args)
+
+def iter_query_cells(query: Query, all_maps: AllOpcodeMaps) -> Iterator[tuple[int, int]]:
+    params = dict(query)
+    map_ids = [ parse_int(params['map']) ] if 'map' in params else range(max_num_maps)
+    opcodes = [ int(params['opcode'], 16) ] if 'opcode' in params else range(256)
+    for map_id in map_ids:
+        for opcode in opcodes:
+            if all_maps[map_id][opcode]:
+                yield (map_id, opcode)
+
+def query_forms(db: sqlite3.Connection, sdm_urls: SdmUrls, query: Query) -> list[dict[str, Any]]:
+    (sql_query, sql_args) = make_sql_query(query)
+    all_maps = collect_all_maps(fetch_rows(db, sql_query, sql_args))
+    results = []
+    for (map_id, opcode) in iter_query_cells(query, all_maps):
+        for (iclass_color, iclass, inst_divs) in make_iclass_infos(all_maps, map_id, opcode):
+            results.append({
+                'map': map_id,
+                'opcode': f'{opcode:02X}',
+                'iclass': iclass,
+                'color': iclass_color,
+                'url': sdm_urls.get(iclass, None),
+                'forms': list(inst_divs),
+            })
+    return results
+
+def html_forms(results: list[dict[str, Any]]) -> str:
+    fragments = []
+    for result in results:
+        iclass = html.escape(result['iclass'])
+        if result['url']:
+            iclass = f'<a href="{html.escape(result["url"])}" target="_blank">{iclass}</a>'
+        title = f'<div style="color: {result["color"]}"><b>map {result["map"]} opcode {result["opcode"]}: {iclass}</b></div>'
+        fragments.append('\n'.join([ '<div class="forms">', title ] + result['forms'] + [ '</div>' ]))
+    return '\n'.join(fragments) + '\n'
+
+class ConnectionPool:
+
+    def __init__(self, db_file: str, size: int, immutable: bool, mmap_size: int):
+        self.dbs = queue.Queue()
+        for _ in range(size):
+            self.dbs.put(open_sqlite_db(db_file, immutable, mmap_size, check_same_thread=False))
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        db = self.dbs.get()
+        try:
+            yield db
+        finally:
+            self.dbs.put(db)
+
+    def close(self) -> None:
+        while not self.dbs.empty():
+            self.dbs.get().close()
+
+class OpcodeMapServer(ThreadingHTTPServer):
+
+    def __init__(self, address: tuple[str, int], pool: ConnectionPool, sdm_urls: SdmUrls, cache_size: int):
+        super().__init__(address, OpcodeMapHandler)
+        self.pool = pool
+        self.sdm_urls = sdm_urls
+        self.answer = lru_cache(maxsize=cache_size)(self.compute_answer)
+
+    def compute_answer(self, query: Query, fmt: str) -> bytes:
+        with self.pool.connection() as db:
+            results = query_forms(db, self.sdm_urls, query)
+        if fmt == 'html':
+            return html_forms(results).encode()
+        return json.dumps(results).encode()
+
+content_types = {
+    'json': 'application/json',
+    'html': 'text/html; charset=utf-8',
+}
+
+class OpcodeMapHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != '/forms':
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            (query, fmt) = parse_query(parse_qs(url.query))
+        except ValueError as err:
+            self.send_error(HTTPStatus.BAD_REQUEST, explain=str(err))
+            return
+        body = self.server.answer(query, fmt)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_types[fmt])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main() -> None:
+    parser = ArgumentParser(description='Serve queries on the opcode map of a SQLite database extracted from a XED build')
+    parser.add_argument('xed_sqlite', type=str, help='input SQLite database extracted from a XED build')
+    parser.add_argument('--sdm-urls-json', default=default_sdm_urls_json,
+                        help=f'input JSON file containing SDM instruction reference URLs (default: {default_sdm_urls_json})')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--connections', type=int, default=4, help='number of pooled SQLite connections (default: 4)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of query results kept in the LRU cache (default: 1024)')
+    parser.add_argument('--immutable', action='store_true',
+                        help='open the SQLite database read-only as an immutable file, i.e., without any locking')
+    parser.add_argument('--mmap-size', type=int, default=sqlite_mmap_size,
+                        help=f'bytes of the SQLite database accessed by memory-mapped I/O (default: {sqlite_mmap_size})')
+    args = parser.parse_args()
+    sdm_urls = input_sdm_urls(args.sdm_urls_json)
+    pool = ConnectionPool(args.xed_sqlite, args.connections, args.immutable, args.mmap_size)
+    with OpcodeMapServer((args.host, args.port), pool, sdm_urls, args.cache_size) as server:
+        print(f'[INFO] serving on http://{args.host}:{server.server_port}/forms')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    pool.close()
+
+if __name__ == '__main__':
+    main()
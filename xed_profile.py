@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import cProfile
+from pathlib import Path
+from contextlib import contextmanager
+from argparse import ArgumentParser
+from typing import Any, Iterable, Iterator, Optional
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ProfileStage = dict[str, Any]
+
+profile_stages: list[ProfileStage] = []
+profile_file: Optional[str] = None
+profiling = False
+profiler: Optional[cProfile.Profile] = None
+
+profile_suffixes = ['.prof', '.json']
+
+def add_profile_argument(parser: ArgumentParser) -> None:
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help=('print the wall time, CPU time, peak RSS, and row count of each stage; '
+                              'with FILE.prof, also dump cProfile stats; with FILE.json, also dump a Chrome trace of the stages'))
+
+def peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def start_profile(profile_arg: Optional[str]) -> None:
+    global profiling, profile_file, profiler
+    if profile_arg is None:
+        return
+    if profile_arg and Path(profile_arg).suffix not in profile_suffixes:
+        raise ValueError(f'the profile file must end in .prof or .json: {profile_arg}')
+    profiling = True
+    profile_file = profile_arg or None
+    if profile_file and Path(profile_file).suffix == '.prof':
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+def profile_enabled() -> bool:
+    return profiling
+
+def start_worker_profile(enabled: bool) -> None:
+    global profiling, profile_file, profiler
+    if profiler:
+        profiler.disable()
+    profiling = enabled
+    profile_file = None
+    profiler = None
+    profile_stages.clear()
+
+def worker_profile_stages() -> list[ProfileStage]:
+    return list(profile_stages)
+
+def merge_profile_stages(tag: str, stages: list[ProfileStage]) -> None:
+    for stage in stages:
+        profile_stages.append(dict(stage, name=f'{tag}: {stage["name"]}'))
+
+def new_stage(name: str, rows: Optional[int]) -> ProfileStage:
+    stage = {
+        'pid': os.getpid(),
+        'name': name,
+        'start': time.perf_counter(),
+        'wall': 0.0,
+        'cpu': 0.0,
+        'rows': rows,
+        'peak_rss': None,
+    }
+    profile_stages.append(stage)
+    return stage
+
+@contextmanager
+def profile_stage(name: str, rows: Optional[int] = None) -> Iterator[ProfileStage]:
+    if not profiling:
+        yield dict()
+        return
+    stage = new_stage(name, rows)
+    start_cpu = time.process_time()
+    try:
+        yield stage
+    finally:
+        stage['wall'] = time.perf_counter() - stage['start']
+        stage['cpu'] = time.process_time() - start_cpu
+        stage['peak_rss'] = peak_rss()
+
+def profile_iter(name: str, rows: Iterable[Any]) -> Iterable[Any]:
+    if not profiling:
+        return rows
+    return iter_profiled(new_stage(name, 0), rows)
+
+def iter_profiled(stage: ProfileStage, rows: Iterable[Any]) -> Iterator[Any]:
+    rows = iter(rows)
+    while True:
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        finally:
+            stage['wall'] += time.perf_counter() - start_time
+            stage['cpu'] += time.process_time() - start_cpu
+            stage['peak_rss'] = peak_rss()
+        stage['rows'] += 1
+        yield row
+
+class ProfiledSink:
+
+    def __init__(self, name: str, sink: Any):
+        self.sink = sink
+        self.stage = new_stage(name, 0)
+
+    def write(self, row: Any) -> None:
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        self.sink.write(row)
+        self.stage['wall'] += time.perf_counter() - start_time
+        self.stage['cpu'] += time.process_time() - start_cpu
+        self.stage['rows'] += 1
+
+    def close(self) -> None:
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        self.sink.close()
+        self.stage['wall'] += time.perf_counter() - start_time
+        self.stage['cpu'] += time.process_time() - start_cpu
+        self.stage['peak_rss'] = peak_rss()
+
+def profile_sink(name: str, sink: Any) -> Any:
+    if not profiling:
+        return sink
+    return ProfiledSink(name, sink)
+
+def format_rss(rss: Optional[int]) -> str:
+    return '-' if rss is None else f'{rss / (1 << 20):.1f}M'
+
+def chrome_trace(stages: list[ProfileStage]) -> dict[str, Any]:
+    start_time = min([ stage['start'] for stage in stages ], default=0.0)
+    events = [ {
+        'name': stage['name'],
+        'ph': 'X',
+        'ts': (stage['start'] - start_time) * 1e6,
+        'dur': stage['wall'] * 1e6,
+        'pid': stage['pid'],
+        'tid': 0,
+        'args': { 'cpu': stage['cpu'], 'rows': stage['rows'], 'peak_rss': stage['peak_rss'] },
+    } for stage in stages ]
+    return { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+
+def finish_profile() -> None:
+    if not profiling:
+        return
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        print(f'[INFO] cProfile stats: {profile_file}', file=sys.stderr)
+    print(f'[INFO] {"stage":<24} {"wall":>9} {"cpu":>9} {"peak rss":>9} {"rows":>9}', file=sys.stderr)
+    for stage in profile_stages:
+        rows = '-' if stage['rows'] is None else stage['rows']
+        print(f'[INFO] {stage["name"]:<24} {stage["wall"]:8.3f}s {stage["cpu"]:8.3f}s '
+              f'{format_rss(stage["peak_rss"]):>9} {rows:>9}', file=sys.stderr)
+    if profile_file and Path(profile_file).suffix == '.json':
+        with open(profile_file, 'w') as trace_fp:
+            json.dump(chrome_trace(profile_stages), trace_fp, indent=1)
+        print(f'[INFO] stage trace: {profile_file}', file=sys.stderr)